@@ -0,0 +1,235 @@
+# alerts.py
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from db import get_alerts, get_alert_state, update_alert_state
+
+# --------------------------------------------------
+# Reglas
+# --------------------------------------------------
+# Umbral de BPM sostenido: (nombre, comparación, umbral, segundos, nivel)
+SUSTAINED_RULES = [
+    ("bpm_high", ">", 120, 30, "danger"),
+    ("bpm_high", ">", 100, 60, "warning"),
+    ("bpm_low", "<", 45, 30, "danger"),
+    ("bpm_low", "<", 55, 60, "warning"),
+]
+
+ZSCORE_ALPHA = 0.05       # EWMA de media/varianza del BPM
+ZSCORE_LIMIT = 3.0
+ZSCORE_MIN_SAMPLES = 30
+
+HRV_BASE_ALPHA = 0.01     # línea base lenta
+HRV_FAST_ALPHA = 0.2      # estado actual
+HRV_DROP = 0.25           # caída relativa que genera alerta
+HRV_MIN_SAMPLES = 30
+
+# ACWR por EWMA diaria (7 / 28 días)
+ACWR_ACUTE_DAYS = 7
+ACWR_CHRONIC_DAYS = 28
+ACWR_MIN_DAYS = 14
+ACWR_BANDS = [(1.5, "danger"), (1.3, "warning")]
+ACWR_LOW = 0.8
+
+FATIGUE_BANDS = [(8, "danger"), (5, "warning")]
+
+LEVELS = {"safe": 0, "warning": 1, "danger": 2}
+RISK_WINDOW_MIN = 10
+
+
+def _new_state():
+    return {
+        "bpm_n": 0, "bpm_mean": 0.0, "bpm_var": 0.0,
+        "hrv_n": 0, "hrv_base": None, "hrv_fast": None,
+        "acute": 0.0, "chronic": 0.0, "load_day": None, "first_day": None,
+        "since": {},    # regla sostenida -> inicio de la condición
+        "active": {},   # regla -> episodio activo {"level", "start"}
+    }
+
+
+def _get_state(user_id):
+    # Solo lectura; las actualizaciones pasan por update_alert_state (una transacción)
+    return get_alert_state(user_id) or _new_state()
+
+
+def _ts_str(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# --------------------------------------------------
+# Episodios + de-duplicación
+# --------------------------------------------------
+def _update_rule(user_id, state, rule, level, ts, message, value, fired):
+    """
+    Abre un episodio cuando la regla pasa a `level` y lo cierra cuando deja de cumplirse.
+    Solo se emite una alerta por episodio (dedup_key única en la tabla alerts);
+    `fired` recibe las candidatas y update_alert_state descarta las repetidas.
+    """
+    active = state["active"].get(rule)
+    if level is None:
+        state["active"].pop(rule, None)
+        return
+    if active and active["level"] == level:
+        return
+
+    start = int(ts)
+    state["active"][rule] = {"level": level, "start": start}
+    fired.append({"user_id": user_id, "rule": rule, "level": level,
+                  "message": message, "value": value, "timestamp": _ts_str(ts),
+                  "dedup_key": f"{user_id}:{rule}:{level}:{start}"})
+
+
+def _check_sustained(user_id, state, ts, bpm, fired):
+    levels = {}
+    for name, op, threshold, seconds, level in SUSTAINED_RULES:
+        key = f"{name}:{threshold}"
+        over = bpm > threshold if op == ">" else bpm < threshold
+        if not over:
+            state["since"].pop(key, None)
+            continue
+        since = state["since"].setdefault(key, ts)
+        if ts - since >= seconds and LEVELS[level] > LEVELS.get(levels.get(name), -1):
+            levels[name] = level
+
+    for name in ("bpm_high", "bpm_low"):
+        level = levels.get(name)
+        _update_rule(user_id, state, name, level, ts,
+                     f"BPM {bpm:.0f} sostenido ({'alto' if name == 'bpm_high' else 'bajo'})",
+                     bpm, fired)
+
+
+def _check_zscore(user_id, state, ts, bpm, fired):
+    n, mean, var = state["bpm_n"], state["bpm_mean"], state["bpm_var"]
+    level = None
+    z = 0.0
+    if n >= ZSCORE_MIN_SAMPLES and var > 0:
+        z = (bpm - mean) / math.sqrt(var)
+        if abs(z) >= ZSCORE_LIMIT:
+            level = "warning"
+
+    # EWMA de media y varianza (O(1))
+    if n == 0:
+        mean, var = bpm, 0.0
+    else:
+        diff = bpm - mean
+        incr = ZSCORE_ALPHA * diff
+        mean += incr
+        var = (1 - ZSCORE_ALPHA) * (var + diff * incr)
+    state["bpm_n"], state["bpm_mean"], state["bpm_var"] = n + 1, mean, var
+
+    _update_rule(user_id, state, "bpm_zscore", level, ts,
+                 f"BPM atípico (z={z:.1f})", bpm, fired)
+
+
+def _check_hrv(user_id, state, ts, hrv, fired):
+    if state["hrv_base"] is None:
+        state["hrv_base"] = state["hrv_fast"] = hrv
+    else:
+        state["hrv_base"] += HRV_BASE_ALPHA * (hrv - state["hrv_base"])
+        state["hrv_fast"] += HRV_FAST_ALPHA * (hrv - state["hrv_fast"])
+    state["hrv_n"] += 1
+
+    base, fast = state["hrv_base"], state["hrv_fast"]
+    level = None
+    if state["hrv_n"] >= HRV_MIN_SAMPLES and base > 0 and fast < base * (1 - HRV_DROP):
+        level = "warning"
+    _update_rule(user_id, state, "hrv_drop", level, ts,
+                 f"Caída de HRV ({fast:.0f} ms vs base {base:.0f} ms)", fast, fired)
+
+
+# --------------------------------------------------
+# API del motor
+# --------------------------------------------------
+def process_samples(user_id, timestamps, bpm=None, hrv=None):
+    """
+    Evalúa las reglas para cada muestra ingerida. Estado O(1) por deportista.
+    timestamps: epoch en segundos. Devuelve las alertas nuevas.
+    """
+    def evaluate(state):
+        state = state or _new_state()
+        fired = []
+        for i, ts in enumerate(timestamps):
+            b = bpm[i] if bpm is not None else None
+            h = hrv[i] if hrv is not None else None
+            if b is not None and not math.isnan(b):
+                _check_sustained(user_id, state, ts, float(b), fired)
+                _check_zscore(user_id, state, ts, float(b), fired)
+            if h is not None and not math.isnan(h):
+                _check_hrv(user_id, state, ts, float(h), fired)
+        return state, fired
+
+    return update_alert_state(user_id, evaluate)
+
+
+def process_sample(user_id, bpm=None, hrv=None, ts=None):
+    ts = time.time() if ts is None else ts
+    return process_samples(
+        user_id, [ts],
+        [bpm] if bpm is not None else None,
+        [hrv] if hrv is not None else None
+    )
+
+
+def process_session(user_id, responses, ts=None):
+    """
+    Cuestionario guardado: fatiga declarada y carga de sesión (rpe * duración) → ACWR.
+    """
+    ts = time.time() if ts is None else ts
+
+    def evaluate(state):
+        state = state or _new_state()
+        fired = []
+
+        fatiga = responses.get("fatiga")
+        if fatiga is not None:
+            fatiga = float(fatiga)
+            level = next((lvl for limit, lvl in FATIGUE_BANDS if fatiga >= limit), None)
+            _update_rule(user_id, state, "fatiga", level, ts, f"Fatiga declarada {fatiga:.0f}/10", fatiga, fired)
+
+        try:
+            load = float(responses["rpe"]) * float(responses["duracion_min"])
+        except (KeyError, TypeError, ValueError):
+            load = None
+
+        if load is not None:
+            day = int(ts // 86400)
+            la = 2 / (ACWR_ACUTE_DAYS + 1)
+            lc = 2 / (ACWR_CHRONIC_DAYS + 1)
+            if state["load_day"] is not None and day > state["load_day"]:
+                # Días sin registro cuentan como carga 0
+                gap = day - state["load_day"]
+                state["acute"] *= (1 - la) ** gap
+                state["chronic"] *= (1 - lc) ** gap
+            state["acute"] += la * load
+            state["chronic"] += lc * load
+            state["load_day"] = day
+            if state["first_day"] is None:
+                state["first_day"] = day
+
+            level = None
+            acwr = state["acute"] / state["chronic"] if state["chronic"] > 0 else None
+            if acwr is not None and day - state["first_day"] >= ACWR_MIN_DAYS:
+                level = next((lvl for limit, lvl in ACWR_BANDS if acwr >= limit), None)
+                if level is None and acwr < ACWR_LOW:
+                    level = "warning"
+            _update_rule(user_id, state, "acwr", level, ts,
+                         f"ACWR {acwr:.2f} fuera de banda" if acwr else "ACWR", acwr, fired)
+        return state, fired
+
+    return update_alert_state(user_id, evaluate)
+
+
+def get_user_risk(user_id, minutes=RISK_WINDOW_MIN):
+    """
+    "safe", "warning" o "danger" según las alertas recientes (sin recorrer el historial).
+    """
+    since = (datetime.now(timezone.utc) - timedelta(minutes=minutes)).strftime("%Y-%m-%d %H:%M:%S")
+    recent = get_alerts([user_id], since=since)
+    state = _get_state(user_id)
+    levels = [a["level"] for a in recent] + [r["level"] for r in state["active"].values()]
+    return max(levels, key=lambda lvl: LEVELS[lvl], default="safe")
+
+
+def get_roster_alerts(user_ids, hours=24, limit=50):
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+    return get_alerts(user_ids, since=since, limit=limit)
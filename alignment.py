@@ -0,0 +1,408 @@
+# alignment.py
+# Alineación multi-frecuencia sobre una rejilla temporal común:
+# ECG (250 Hz) → FC instantánea, IMU (su propia fs) → intensidad de movimiento,
+# y filas de resumen de sensor_data (≈1 cada 2 s). Todo por bloques.
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from scipy.signal import butter, sosfilt, sosfilt_zi, group_delay
+from db import get_sensor_frame, to_epoch_us, US
+from ecg import detect_r_peaks, signal_quality, REFRACTORY_S, RR_RANGE_S
+from imu import G, ACTIVITY_THRESHOLD
+from opensignals import read_opensignals, ecg_to_mv, acc_to_ms2
+
+DEFAULT_FS_OUT = 4.0            # Hz de la rejilla común
+ANTIALIAS_ORDER = 4
+ANTIALIAS_CUTOFF = 0.4          # × fs_out (por debajo de Nyquist de la rejilla)
+ASOF_TOLERANCE_S = 3.0          # un valor "as-of" más antiguo que esto no vale
+ECG_TAIL_S = 1.0                # cola del bloque ECG anterior que se vuelve a analizar
+HR_LAG_S = 10.0                 # la FC responde al movimiento con retraso
+CHUNK_S = 60
+GRID_EPS = 1e-4                 # tolerancia (en pasos de rejilla) con tiempos epoch en float
+
+
+# --------------------------------------------------
+# Utilidades vectorizadas
+# --------------------------------------------------
+@lru_cache(maxsize=32)
+def antialias_sos(fs_in, fs_out):
+    """
+    Paso bajo antialias para pasar de fs_in a fs_out y su retardo de grupo (s).
+    None si no hace falta (fs_out >= fs_in).
+    """
+    cutoff = ANTIALIAS_CUTOFF * fs_out
+    if cutoff >= 0.5 * fs_in:
+        return None, 0.0
+    sos = butter(ANTIALIAS_ORDER, cutoff, btype="lowpass", fs=fs_in, output="sos")
+    # Suma del retardo de cada sección: el polinomio completo (sos2tf) está mal
+    # condicionado a 1000 Hz con un corte de pocos Hz
+    delay = sum(group_delay((sec[:3], sec[3:]), w=[0.1 * cutoff], fs=fs_in)[1][0] for sec in sos)
+    return sos, float(delay) / fs_in
+
+
+def grid_index(t_start, t_stop, fs_out):
+    """
+    Índices k de la rejilla (instantes k / fs_out) dentro de [t_start, t_stop].
+    Al ser múltiplos absolutos, los bloques consecutivos encajan sin solaparse.
+    """
+    lo = int(np.ceil(t_start * fs_out - GRID_EPS))
+    hi = int(np.floor(t_stop * fs_out + GRID_EPS))
+    return np.arange(lo, hi + 1)
+
+
+def grid_timestamps(k, fs_out):
+    """
+    Instantes k / fs_out (s desde epoch) como fechas UTC naive, en µs exactos:
+    rejillas con la misma fs_out se pueden unir por esta columna.
+    """
+    us = np.round(np.asarray(k, dtype=float) * (US / fs_out)).astype(np.int64)
+    return pd.to_datetime(us, unit="us")
+
+
+def asof(grid_t, t, values, tolerance_s=ASOF_TOLERANCE_S):
+    """
+    Último valor con t <= instante de la rejilla (merge_asof "backward"),
+    NaN si es más antiguo que tolerance_s. t ordenado; values 1D o 2D.
+    """
+    grid_t = np.asarray(grid_t, dtype=float)
+    t = np.asarray(t, dtype=float)
+    values = np.asarray(values, dtype=float)
+    out = np.full((len(grid_t),) + values.shape[1:], np.nan)
+    if len(t) == 0:
+        return out
+    idx = np.searchsorted(t, grid_t, side="right") - 1
+    safe = np.maximum(idx, 0)
+    ok = (idx >= 0) & (grid_t - t[safe] <= tolerance_s)
+    out[ok] = values[safe[ok]]
+    return out
+
+
+def interpolate(grid_t, t, values, max_gap_s=ASOF_TOLERANCE_S):
+    """
+    Interpolación lineal en la rejilla; NaN fuera del rango o dentro de huecos
+    mayores que max_gap_s. values 1D o 2D (una columna por canal).
+    """
+    grid_t = np.asarray(grid_t, dtype=float)
+    t = np.asarray(t, dtype=float)
+    values = np.asarray(values, dtype=float)
+    flat = values.reshape(len(t), -1)
+    out = np.full((len(grid_t), flat.shape[1]), np.nan)
+    if len(t) < 2:
+        return out.reshape((len(grid_t),) + values.shape[1:])
+
+    i = np.clip(np.searchsorted(t, grid_t, side="right") - 1, 0, len(t) - 2)
+    span = t[i + 1] - t[i]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(span > 0, (grid_t - t[i]) / span, 0.0)
+    ok = (grid_t >= t[0]) & (grid_t <= t[-1]) & (span <= max_gap_s)
+    out[ok] = flat[i[ok]] * (1 - frac[ok, None]) + flat[i[ok] + 1] * frac[ok, None]
+    return out.reshape((len(grid_t),) + values.shape[1:])
+
+
+# --------------------------------------------------
+# Flujos por bloques
+# --------------------------------------------------
+class StreamResampler:
+    """
+    Lleva un flujo regular de fs_in a la rejilla común, bloque a bloque:
+    paso bajo antialias (sosfilt con zi entre bloques, retardo compensado)
+    e interpolación en los instantes de la rejilla cubiertos por el bloque.
+    """
+
+    def __init__(self, fs_in, fs_out=DEFAULT_FS_OUT):
+        self.fs_in = fs_in
+        self.fs_out = fs_out
+        self.sos, self.delay_s = antialias_sos(fs_in, fs_out)
+        self.zi = None
+        self.last = None    # (t, valores) de la última muestra filtrada
+        self.last_k = None
+
+    def push(self, t0, block):
+        """
+        block: (n,) o (n, canales) empezando en t0. Devuelve (k, valores).
+        """
+        block = np.asarray(block, dtype=float)
+        y = block.reshape(len(block), -1)
+        if len(y) == 0:
+            return np.array([], dtype=int), y[:0]
+
+        if self.sos is not None:
+            if self.zi is None:
+                self.zi = sosfilt_zi(self.sos)[:, :, None] * y[0]
+            y, self.zi = sosfilt(self.sos, y, axis=0, zi=self.zi)
+        t = t0 + np.arange(len(y)) / self.fs_in - self.delay_s
+
+        # La última muestra del bloque anterior permite interpolar a través del borde
+        if self.last is not None:
+            t = np.concatenate(([self.last[0]], t))
+            y = np.vstack((self.last[1], y))
+        self.last = (t[-1], y[-1:])
+
+        k = grid_index(t[0], t[-1], self.fs_out)
+        if self.last_k is not None:
+            k = k[k > self.last_k]
+        if len(k):
+            self.last_k = k[-1]
+        values = interpolate(k / self.fs_out, t, y, max_gap_s=1.5 / self.fs_in)
+        return k, values.reshape(len(k), *block.shape[1:])
+
+
+class HeartRateStream:
+    """
+    ECG por bloques → FC instantánea (60 / RR) en la rejilla común (as-of).
+    Se reanaliza la cola del bloque anterior para no perder latidos en el borde.
+    """
+
+    def __init__(self, fs, fs_out=DEFAULT_FS_OUT, tolerance_s=ASOF_TOLERANCE_S):
+        self.fs = fs
+        self.fs_out = fs_out
+        self.tolerance_s = tolerance_s
+        self.tail = np.array([])
+        self.tail_t0 = None
+        self.last_r = None          # instante del último pico R
+        self.last_hr = None         # (t, hr) del último valor válido
+        self.last_k = None
+
+    def _r_times(self, t0, ecg):
+        if self.tail_t0 is not None and len(self.tail):
+            t0, ecg = self.tail_t0, np.concatenate((self.tail, ecg))
+        tail = int(ECG_TAIL_S * self.fs)
+        self.tail, self.tail_t0 = ecg[-tail:], t0 + (len(ecg) - len(ecg[-tail:])) / self.fs
+
+        peaks = detect_r_peaks(ecg, self.fs, signal_quality(ecg, self.fs))
+        r = t0 + peaks / self.fs
+        if self.last_r is not None:
+            r = r[r > self.last_r + REFRACTORY_S]
+            r = np.concatenate(([self.last_r], r))
+        if len(r):
+            self.last_r = r[-1]
+        return r
+
+    def push(self, t0, ecg):
+        ecg = np.asarray(ecg, dtype=float)
+        r = self._r_times(t0, ecg)
+
+        rr = np.diff(r)
+        ok = (rr >= RR_RANGE_S[0]) & (rr <= RR_RANGE_S[1])
+        t_hr, hr = r[1:][ok], 60 / rr[ok]
+        if self.last_hr is not None:
+            t_hr = np.concatenate(([self.last_hr[0]], t_hr))
+            hr = np.concatenate(([self.last_hr[1]], hr))
+        if len(hr):
+            self.last_hr = (t_hr[-1], hr[-1])
+
+        k = grid_index(t0, t0 + (len(ecg) - 1) / self.fs, self.fs_out)
+        if self.last_k is not None:
+            k = k[k > self.last_k]
+        if len(k):
+            self.last_k = k[-1]
+        return k, asof(k / self.fs_out, t_hr, hr, self.tolerance_s)
+
+
+class MovementHRResponse:
+    """
+    Respuesta de la FC a la intensidad de movimiento con sumas acumuladas
+    (regresión y correlación sin guardar la sesión). La intensidad se empareja
+    con la FC `lag_s` segundos después.
+    """
+
+    def __init__(self, fs_out=DEFAULT_FS_OUT, lag_s=HR_LAG_S, active_threshold=ACTIVITY_THRESHOLD):
+        self.lag = int(round(lag_s * fs_out))
+        self.active_threshold = active_threshold
+        self.pending = np.array([])     # intensidades aún sin FC emparejada
+        self.sums = np.zeros(6)         # n, Σx, Σy, Σxx, Σxy, Σyy
+        self.zones = np.zeros(4)        # n y ΣFC en reposo / en actividad
+
+    def push(self, hr, intensity):
+        """
+        hr, intensity: filas consecutivas de la rejilla (NaN = sin dato).
+        """
+        x = np.concatenate((self.pending, intensity))
+        n = len(hr)
+        if len(x) <= self.lag:
+            self.pending = x
+            return
+        x_lag = x[:len(x) - self.lag][-n:]
+        y = np.asarray(hr, dtype=float)[-len(x_lag):]
+        self.pending = x[len(x) - self.lag:] if self.lag else np.array([])
+
+        ok = ~np.isnan(x_lag) & ~np.isnan(y)
+        x_lag, y = x_lag[ok], y[ok]
+        self.sums += [len(y), x_lag.sum(), y.sum(), x_lag @ x_lag, x_lag @ y, y @ y]
+        active = x_lag >= self.active_threshold
+        self.zones += [(~active).sum(), y[~active].sum(), active.sum(), y[active].sum()]
+
+    def result(self):
+        n, sx, sy, sxx, sxy, syy = self.sums
+        out = {"n": int(n), "slope": None, "intercept": None, "r": None,
+               "hr_rest": None, "hr_active": None}
+        if n >= 2:
+            cov = sxy - sx * sy / n
+            var_x = sxx - sx * sx / n
+            var_y = syy - sy * sy / n
+            if var_x > 0:
+                out["slope"] = float(cov / var_x)                   # bpm por m/s²
+                out["intercept"] = float((sy - out["slope"] * sx) / n)
+            if var_x > 0 and var_y > 0:
+                out["r"] = float(cov / np.sqrt(var_x * var_y))
+        n_rest, hr_rest, n_active, hr_active = self.zones
+        if n_rest:
+            out["hr_rest"] = float(hr_rest / n_rest)
+        if n_active:
+            out["hr_active"] = float(hr_active / n_active)
+        return out
+
+
+# --------------------------------------------------
+# Pipeline
+# --------------------------------------------------
+GRID_COLUMNS = ["timestamp", "t", "hr", "intensity"]
+
+
+class AlignmentPipeline:
+    """
+    Combina ECG e IMU (cada uno con su fs y sus bloques) en filas de la rejilla
+    común: timestamp, t (s desde epoch), hr, intensity. Una fila se emite cuando
+    ambos flujos la han cubierto. Los t0 de los bloques son epoch en segundos.
+    """
+
+    def __init__(self, fs_out=DEFAULT_FS_OUT, lag_s=HR_LAG_S):
+        self.fs_out = fs_out
+        self.hr_stream = None
+        self.imu_stream = None
+        self.response = MovementHRResponse(fs_out, lag_s)
+        self.pending = {"hr": [], "intensity": []}
+        self.emitted_k = None
+
+    def push_ecg(self, t0, ecg, fs):
+        if self.hr_stream is None:
+            self.hr_stream = HeartRateStream(fs, self.fs_out)
+        self.pending["hr"].append(self.hr_stream.push(t0, ecg))
+
+    def push_imu(self, t0, accel, fs):
+        """
+        accel: (n, 3) en m/s². Intensidad = |‖a‖ − g|, filtrada antes de diezmar.
+        """
+        if self.imu_stream is None:
+            self.imu_stream = StreamResampler(fs, self.fs_out)
+        accel = np.asarray(accel, dtype=float)
+        magnitude = np.sqrt(np.einsum("ij,ij->i", accel, accel))
+        self.pending["intensity"].append(self.imu_stream.push(t0, np.abs(magnitude - G)))
+
+    def _covered(self, name):
+        stream = self.hr_stream if name == "hr" else self.imu_stream
+        return None if stream is None else stream.last_k
+
+    def emit(self, final=False):
+        """
+        DataFrame con las filas listas (todas si final=True) y actualiza la respuesta FC/movimiento.
+        """
+        empty = pd.DataFrame(columns=GRID_COLUMNS)
+        covered = [k for k in map(self._covered, self.pending) if k is not None]
+        if not covered:
+            return empty
+        # Sin final se espera al flujo más retrasado
+        k_hi = max(covered) if final else min(covered)
+        if self.emitted_k is not None and k_hi <= self.emitted_k:
+            return empty
+
+        parts = {}
+        for name, blocks in self.pending.items():
+            k = np.concatenate([b[0] for b in blocks]) if blocks else np.array([], dtype=int)
+            v = np.concatenate([b[1] for b in blocks]) if blocks else np.array([])
+            keep = k > k_hi
+            self.pending[name] = [(k[keep], v[keep])] if keep.any() else []
+            parts[name] = (k[~keep], v[~keep])
+
+        starts = [p[0][0] for p in parts.values() if len(p[0])]
+        if not starts:
+            return empty
+        k_lo = min(starts) if self.emitted_k is None else self.emitted_k + 1
+        k_all = np.arange(k_lo, k_hi + 1)
+        out = {"timestamp": grid_timestamps(k_all, self.fs_out), "t": k_all / self.fs_out}
+        for name, (k, v) in parts.items():
+            col = np.full(len(k_all), np.nan)
+            inside = (k >= k_lo) & (k <= k_hi)
+            col[k[inside] - k_lo] = v[inside]
+            out[name] = col
+        self.emitted_k = k_hi
+
+        self.response.push(out["hr"], out["intensity"])
+        return pd.DataFrame(out)
+
+
+def recording_start(rec, t0=None):
+    """
+    Inicio de la grabación en segundos desde epoch: t0 si se da (epoch, datetime
+    o texto ISO) y si no la fecha/hora de la cabecera OpenSignals. Como en
+    sensor_data, las horas sin zona se toman como UTC.
+    """
+    start = rec.start_time if t0 is None else t0
+    if start is None:
+        raise ValueError("La grabación no trae fecha de inicio en la cabecera: indica t0")
+    return to_epoch_us(start) / US
+
+
+def iter_aligned_recording(path, ecg="ECG", accel=None, fs_out=DEFAULT_FS_OUT,
+                           chunk_s=CHUNK_S, pipeline=None, t0=None):
+    """
+    Grabación OpenSignals (ECG + acelerómetro) → bloques de la rejilla común.
+    accel: {"accel_x": "A3", ...} (etiqueta o sensor). Genera DataFrames
+    timestamp, t, hr, intensity en tiempo absoluto (ver recording_start), la
+    misma rejilla que align_sensor_history.
+    """
+    rec = read_opensignals(path) if isinstance(path, str) else path
+    offset = recording_start(rec, t0)
+    pipeline = pipeline or AlignmentPipeline(fs_out)
+    names = [ecg] + (list(accel.values()) if accel else [])
+    ecg_res = rec.resolution(ecg)
+    for t_start, chunk in rec.iter_chunks(names, chunk_s):
+        pipeline.push_ecg(offset + t_start, ecg_to_mv(chunk[ecg], ecg_res), rec.fs)
+        if accel:
+            xyz = np.column_stack([acc_to_ms2(chunk[name], rec.resolution(name)) for name in accel.values()])
+            pipeline.push_imu(offset + t_start, xyz, rec.fs)
+        yield pipeline.emit()
+    yield pipeline.emit(final=True)
+
+
+def process_recording(path, ecg="ECG", accel=None, fs_out=DEFAULT_FS_OUT, chunk_s=CHUNK_S,
+                      lag_s=HR_LAG_S, t0=None):
+    """
+    Devuelve (rejilla común como DataFrame, respuesta FC/movimiento como dict).
+    """
+    pipeline = AlignmentPipeline(fs_out, lag_s)
+    parts = [df for df in iter_aligned_recording(path, ecg, accel, fs_out, chunk_s, pipeline, t0)
+             if not df.empty]
+    frame = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=GRID_COLUMNS)
+    return frame, pipeline.response.result()
+
+
+# --------------------------------------------------
+# Filas de resumen de sensor_data
+# --------------------------------------------------
+def align_sensor_history(user_id, fs_out=0.5, days=None, columns=("bpm", "hrv"),
+                         tolerance_s=ASOF_TOLERANCE_S):
+    """
+    Filas de sensor_data en una rejilla regular (as-of con tolerancia), con los
+    mismos instantes k / fs_out que process_recording.
+    La rejilla solo cubre los tramos con datos: los huecos entre sesiones no se rellenan.
+    """
+    df = get_sensor_frame(user_id, days, parse_dates=False)
+    columns = list(columns)
+    if df.empty:
+        return pd.DataFrame(columns=["timestamp"] + columns)
+
+    t = df["timestamp"].to_numpy() / 1e6
+    # Sesiones: se corta donde el hueco supera la tolerancia
+    cut = np.flatnonzero(np.diff(t) > tolerance_s) + 1
+    first, last = t[np.r_[0, cut]], t[np.r_[cut - 1, len(t) - 1]]
+    lo = np.ceil(first * fs_out - GRID_EPS).astype(np.int64)
+    hi = np.floor(last * fs_out + GRID_EPS).astype(np.int64)
+    counts = np.maximum(hi - lo + 1, 0)
+    k = np.repeat(lo - np.cumsum(np.r_[0, counts[:-1]]), counts) + np.arange(counts.sum())
+
+    grid_t = k / fs_out
+    values = asof(grid_t, t, df[columns].to_numpy(dtype=float), tolerance_s)
+    out = pd.DataFrame(values, columns=columns)
+    out.insert(0, "timestamp", grid_timestamps(k, fs_out))
+    return out
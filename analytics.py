@@ -0,0 +1,168 @@
+# analytics.py
+import numpy as np
+import pandas as pd
+from db import (get_questionnaire_history, get_sensor_frame, get_questionnaire_span,
+                get_sensor_version, to_epoch_us)
+
+G = 9.81
+
+# Ventana de sensores asociada a cada cuestionario (la sesión que se está valorando)
+SESSION_WINDOW_MIN = 120
+ASOF_TOLERANCE = pd.Timedelta(minutes=10)
+RESTING_SMOOTH = 5          # muestras de mediana móvil antes del mínimo
+ROLLING_WINDOW = 7          # cuestionarios por ventana de correlación
+
+CORRELATION_PAIRS = [
+    ("fatiga", "hrv_mean"),
+    ("fatiga", "peak_hr"),
+    ("rpe", "movement_load"),
+    ("energia", "resting_hr"),
+    ("suenio", "hrv_mean"),
+]
+
+_cache = {}
+
+
+# --------------------------------------------------
+# Carga de datos en columnas
+# --------------------------------------------------
+def _questionnaire_frame(user_id):
+    df = get_questionnaire_history(user_id, as_frame=True)
+    if df.empty:
+        return pd.DataFrame()
+    # Varios cuestionarios guardados a la vez → una sola fila
+    df = df.drop(columns="questionnaire_id").groupby("timestamp", as_index=False).first()
+    for col in df.columns.drop("timestamp"):
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df.sort_values("timestamp", ignore_index=True)
+
+
+def _sensor_range(first, last, window_min):
+    """
+    Rango de sensores (µs) que usa el cruce: desde la ventana del primer
+    cuestionario (o la tolerancia del as-of, si es mayor) hasta el último.
+    """
+    reach = max(pd.Timedelta(minutes=window_min), ASOF_TOLERANCE) // pd.Timedelta(microseconds=1)
+    return to_epoch_us(first) - reach, to_epoch_us(last)
+
+
+def _sensor_frame(user_id, start=None, end=None):
+    df = get_sensor_frame(user_id, start=start, end=end)
+    if df.empty:
+        return df
+    accel = df[["accel_x", "accel_y", "accel_z"]].to_numpy(dtype=float)
+    df["movement"] = np.abs(np.sqrt(np.einsum("ij,ij->i", accel, accel)) - G)
+    return df.sort_values("timestamp", ignore_index=True)
+
+
+# --------------------------------------------------
+# Agregados por ventana (vectorizados)
+# --------------------------------------------------
+def _window_sum(values, lo, hi):
+    valid = ~np.isnan(values)
+    cs = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    cn = np.concatenate(([0], np.cumsum(valid)))
+    return cs[hi] - cs[lo], cn[hi] - cn[lo]
+
+
+def _window_reduce(ufunc, values, lo, hi, fill):
+    out = np.full(len(lo), np.nan)
+    has = hi > lo
+    if has.any():
+        ext = np.append(np.where(np.isnan(values), fill, values), fill)
+        bounds = np.column_stack((lo[has], hi[has])).ravel()
+        out[has] = ufunc.reduceat(ext, bounds)[::2]
+    out[out == fill] = np.nan
+    return out
+
+
+def align_questionnaires(user_id, window_min=SESSION_WINDOW_MIN):
+    """
+    Une cada cuestionario con los datos de sensor de los `window_min` minutos anteriores.
+    Columnas añadidas: resting_hr, peak_hr, mean_hr, hrv_mean, movement_load,
+    n_samples y last_bpm (as-of join con la última muestra).
+    """
+    q = _questionnaire_frame(user_id)
+    if q.empty:
+        return q
+    s = _sensor_frame(user_id, *_sensor_range(q["timestamp"].iloc[0], q["timestamp"].iloc[-1], window_min))
+
+    stats = ["resting_hr", "peak_hr", "mean_hr", "hrv_mean", "movement_load", "n_samples", "last_bpm"]
+    if s.empty:
+        return q.assign(**{c: np.nan for c in stats})
+
+    t_s = s["timestamp"].to_numpy()
+    t_q = q["timestamp"].to_numpy()
+    lo = np.searchsorted(t_s, t_q - np.timedelta64(window_min, "m"), side="left")
+    hi = np.searchsorted(t_s, t_q, side="right")
+
+    bpm = s["bpm"].to_numpy(dtype=float)
+    smooth = s["bpm"].rolling(RESTING_SMOOTH, min_periods=1, center=True).median().to_numpy(dtype=float)
+    hrv = s["hrv"].to_numpy(dtype=float) if "hrv" in s else np.full(len(s), np.nan)
+
+    bpm_sum, bpm_n = _window_sum(bpm, lo, hi)
+    hrv_sum, hrv_n = _window_sum(hrv, lo, hi)
+    move_sum, _ = _window_sum(s["movement"].to_numpy(dtype=float), lo, hi)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        q["resting_hr"] = _window_reduce(np.minimum, smooth, lo, hi, np.inf)
+        q["peak_hr"] = _window_reduce(np.maximum, bpm, lo, hi, -np.inf)
+        q["mean_hr"] = np.where(bpm_n > 0, bpm_sum / bpm_n, np.nan)
+        q["hrv_mean"] = np.where(hrv_n > 0, hrv_sum / hrv_n, np.nan)
+    q["movement_load"] = move_sum
+    q["n_samples"] = hi - lo
+
+    last = pd.merge_asof(q[["timestamp"]], s[["timestamp", "bpm"]], on="timestamp",
+                         direction="backward", tolerance=ASOF_TOLERANCE)
+    q["last_bpm"] = last["bpm"].to_numpy()
+    return q
+
+
+def rolling_correlations(aligned, window=ROLLING_WINDOW, pairs=CORRELATION_PAIRS):
+    """
+    Correlación móvil entre respuestas y métricas de sensor, cuestionario a cuestionario.
+    """
+    out = aligned[["timestamp"]].copy()
+    for a, b in pairs:
+        if a in aligned and b in aligned:
+            corr = aligned[a].rolling(window, min_periods=3).corr(aligned[b])
+            out[f"{a}~{b}"] = corr.replace([np.inf, -np.inf], np.nan)
+    return out
+
+
+# --------------------------------------------------
+# Memoización (se invalida cuando cambian los datos que entran en el cruce)
+# --------------------------------------------------
+def get_analysis(user_id):
+    """
+    (tabla alineada, correlaciones móviles) con una sola comprobación de versión:
+    la vista del coreógrafo pide las dos en cada refresco. Las muestras en vivo
+    posteriores al último cuestionario no cambian la tabla, así que la versión
+    solo cuenta las del rango de ventanas.
+    """
+    span = get_questionnaire_span(user_id)
+    version = span
+    if span[0]:
+        version += get_sensor_version(user_id, *_sensor_range(span[2], span[3], SESSION_WINDOW_MIN))
+    cached = _cache.get(user_id)
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+    table = align_questionnaires(user_id)
+    corr = rolling_correlations(table) if not table.empty else table
+    _cache[user_id] = (version, table, corr)
+    return table, corr
+
+
+def get_aligned_table(user_id):
+    return get_analysis(user_id)[0]
+
+
+def get_correlations(user_id):
+    return get_analysis(user_id)[1]
+
+
+def invalidate(user_id=None):
+    if user_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(user_id, None)
@@ -1,21 +1,31 @@
 import os
+import gzip
+import zlib
+import base64
+import json
+import time
 import dash
 from dash import dcc, html, Input, Output, State, ALL, ctx, no_update
 import dash_bootstrap_components as dbc
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 from flask import request, jsonify
 from flask import send_file
-from flask import session
 from db import (
     init_db, register_user, authenticate_user,
     save_questionnaire, get_questionnaire_history,
     get_training_load_history, compute_acwr,
-    save_sensor_data, get_sensor_history,
-    get_athletes_by_sport,export_user_data_csv
+    save_sensor_data, save_sensor_data_bulk, get_sensor_history,
+    get_athletes_by_sport, get_user_jobs,
+    claim_ingest_batch, release_ingest_batch, register_ingest_batch, get_daily_hr_load
 )
 from questionnaires import QUESTIONNAIRES, get_questionnaire_list, render_questionnaire_form
-from sensors import parse_csv_contents, load_ecg_and_compute_bpm, process_imu
+from analytics import get_analysis
+from jobs import submit_job, cancel_job, export_task, import_task
+from hr_load import update_hr_load
+from alerts import process_samples, process_session, get_user_risk, get_roster_alerts
+from sensors import process_imu, decode_sensor_packet
 
 # ==========================================================
 # INIT
@@ -94,7 +104,14 @@ def dancer_view(sess):
         ),
         html.Div(id="import-msg", className="mt-2")
     ])
-], className="mt-2"),                
+], className="mt-2"),
+                dbc.Card([
+                    dbc.CardHeader("⚙️ Trabajos"),
+                    dbc.CardBody([
+                        html.Div(id="jobs-panel"),
+                        html.Div(id="job-cancel-msg")
+                    ])
+                ], className="mt-2"),                
             ], md=4),
             
             dbc.Col([
@@ -123,7 +140,14 @@ def coach_view():
             # IDs CORREGIDOS PARA COINCIDIR CON LOS CALLBACKS
             dbc.Col(dbc.Card([dbc.CardHeader("Carga"), dbc.CardBody(dcc.Graph(id="coach-load-graph"))]), md=6),
             dbc.Col(dbc.Card([dbc.CardHeader("BPM"), dbc.CardBody(dcc.Graph(id="coach-bpm-graph"))]), md=6)
-        ])
+        ]),
+        dbc.Row([
+            dbc.Col(dbc.Card([dbc.CardHeader("Cuestionarios vs sensores"), dbc.CardBody(dcc.Graph(id="coach-corr-graph"))]), md=6),
+            dbc.Col(dbc.Card([dbc.CardHeader("Correlación móvil"), dbc.CardBody(dcc.Graph(id="coach-rollcorr-graph"))]), md=6)
+        ], className="mt-3"),
+        dbc.Row([
+            dbc.Col(dbc.Card([dbc.CardHeader("🚨 Alertas del grupo (24 h)"), dbc.CardBody(html.Div(id="coach-alerts"))]), md=12)
+        ], className="mt-3")
     ], fluid=True)
 
 # ==========================================================
@@ -141,31 +165,41 @@ app.layout = html.Div([
 
 import plotly.graph_objects as go
 
-def calculate_user_risk(user_id):
-    """
-    Devuelve: "safe", "warning" o "danger"
-    Basado solo en BPM y actividad
-    """
+# Por encima de este número de puntos las series se dibujan con WebGL
+WEBGL_THRESHOLD = 5000
 
-    data = get_sensor_history(user_id)
 
-    if not data:
-        return "safe"
+def _typed_array(values, dtype="f4"):
+    """
+    Array numérico → {"dtype", "bdata"} en base64: plotly.js lo lee como
+    typed array sin parsear un número JSON por punto.
+    """
+    arr = np.ascontiguousarray(pd.to_numeric(pd.Series(values), errors="coerce"),
+                               dtype=np.dtype(dtype).newbyteorder("<"))
+    return {"dtype": dtype, "bdata": base64.b64encode(arr.tobytes()).decode("ascii")}
 
-    last = data[-1]   # último registro
 
-    bpm = last.get("bpm")
+def _epoch_ms(ts):
+    # Fechas → ms desde epoch (UTC); el eje x se declara de tipo "date"
+    ts = pd.to_datetime(pd.Series(ts), format="ISO8601")
+    return ((ts - pd.Timestamp(0)) / pd.Timedelta(milliseconds=1)).to_numpy(dtype=float)
 
-    if bpm is None:
-        return "safe"
 
-    if bpm > 120 or bpm < 45:
-        return "danger"
+def series_trace(x, y, **kwargs):
+    """
+    Traza de serie temporal: Scattergl si hay más de WEBGL_THRESHOLD puntos,
+    x como epoch en ms (float64) e y como float32, ambos en binario.
+    """
+    trace = go.Scattergl if len(y) > WEBGL_THRESHOLD else go.Scatter
+    return trace(x=_typed_array(_epoch_ms(x), "f8"), y=_typed_array(y), **kwargs)
 
-    if bpm > 100 or bpm < 55:
-        return "warning"
 
-    return "safe"
+def calculate_user_risk(user_id):
+    """
+    Devuelve: "safe", "warning" o "danger"
+    Según las alertas generadas en la ingesta (alerts.py)
+    """
+    return get_user_risk(user_id)
 
 
 
@@ -174,15 +208,16 @@ def make_bpm_figure(df):
         return go.Figure()
 
     fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df["timestamp"],
-        y=df["bpm"],
+    fig.add_trace(series_trace(
+        df["timestamp"],
+        df["bpm"],
         mode="lines+markers",
         name="BPM"
     ))
     fig.update_layout(
         margin=dict(l=10, r=10, t=10, b=10),
-        height=230
+        height=230,
+        xaxis_type="date"
     )
     return fig
 
@@ -194,15 +229,16 @@ def make_imu_figure(df):
     accel = (df["accel_x"]**2 + df["accel_y"]**2 + df["accel_z"]**2) ** 0.5
 
     fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df["timestamp"],
-        y=accel,
+    fig.add_trace(series_trace(
+        df["timestamp"],
+        accel,
         mode="lines+markers",
         name="Aceleración"
     ))
     fig.update_layout(
         margin=dict(l=10, r=10, t=10, b=10),
-        height=230
+        height=230,
+        xaxis_type="date"
     )
     return fig
 
@@ -295,15 +331,14 @@ def handle_auth(n_clicks, login_vals, reg_vals):
     prevent_initial_call=True
 )
 def save_dancer_data(n, qs, vals, sess):
-    if not n or not sess: return no_update, no_update, no_update
-    it = iter(vals); fatiga = 0; uid = sess["user_id"]
+    if not n or not sess: return no_update, no_update
+    it = iter(vals); uid = sess["user_id"]
     for q in qs:
         resp = {f["key"]: next(it, None) for f in QUESTIONNAIRES[q]["fields"]}
-        if "fatiga" in resp: fatiga = float(resp["fatiga"] or 0)
         save_questionnaire(uid, q, resp)
-    alert = dbc.Alert("🟢 ÓPTIMO", color="success") if fatiga < 5 else dbc.Alert("🔴 RIESGO", color="danger")
+        process_session(uid, resp)
     
-    return dbc.Alert("Guardado", color="success", duration=2000), alert
+    return dbc.Alert("Guardado", color="success", duration=2000), build_status_alert(uid)
 
 @app.callback(
     [Output("bpm-graph", "figure"), Output("imu-graph", "figure")],
@@ -312,15 +347,16 @@ def save_dancer_data(n, qs, vals, sess):
 def update_dancer_plots(n, sess):
     # SEGURIDAD: Solo ejecutar si el rol es deportista
     if not sess or sess.get("rol") != "deportista": return go.Figure(), go.Figure()
-    df = pd.DataFrame(get_sensor_history(sess["user_id"]))
+    df = get_sensor_history(sess["user_id"], as_frame=True)
     f_bpm = go.Figure(); f_imu = go.Figure()
     if not df.empty:
-        ts = pd.to_datetime(df.timestamp)
-        f_bpm.add_trace(go.Scatter(x=ts, y=df.bpm, name="BPM", line_color="red"))
+        ts = df.timestamp
+        f_bpm.add_trace(series_trace(ts, df.bpm, name="BPM", line_color="red"))
         if "accel_x" in df.columns:
             mag = (df.accel_x**2 + df.accel_y**2 + df.accel_z**2)**0.5
-            f_imu.add_trace(go.Scatter(x=ts, y=mag, name="IMU", line_color="orange"))
-    f_bpm.update_layout(template="plotly_dark", title="Pulso Live"); f_imu.update_layout(template="plotly_dark", title="IMU Live")
+            f_imu.add_trace(series_trace(ts, mag, name="IMU", line_color="orange"))
+    f_bpm.update_layout(template="plotly_dark", title="Pulso Live", xaxis_type="date")
+    f_imu.update_layout(template="plotly_dark", title="IMU Live", xaxis_type="date")
     return f_bpm, f_imu
 
 @app.callback(
@@ -331,31 +367,25 @@ def update_questionnaire_graph(n, sess):
     if not sess or sess.get("rol") != "deportista":
         return go.Figure()
 
-    data = get_questionnaire_history(sess["user_id"], days=30)
+    df = get_questionnaire_history(sess["user_id"], days=30, as_frame=True)
 
-    if not data:
+    if df.empty:
         return go.Figure()
 
-    df = pd.DataFrame([
-        {"timestamp": d["timestamp"], **d["responses"]}
-        for d in data
-    ])
-
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-
     fig = go.Figure()
 
     for col in ["fatiga", "rpe", "horas", "energia"]:
         if col in df.columns:
-            fig.add_trace(go.Scatter(
-                x=df["timestamp"],
-                y=df[col],
+            fig.add_trace(series_trace(
+                df["timestamp"],
+                df[col],
                 mode="lines+markers",
                 name=col.capitalize()
             ))
 
     fig.update_layout(
         template="plotly_dark",
+        xaxis_type="date",
         title="Evolución Cuestionarios",
         margin=dict(l=10, r=10, t=40, b=10),
         legend_title="Variables"
@@ -372,59 +402,70 @@ def update_questionnaire_graph(n, sess):
 def export_user_data(n, sess):
     if not n or not sess:
         return no_update
-    
-    try:
-        path = export_user_data_csv(sess["user_id"])
-        # Link de descarga
-        return dbc.Alert(
-            html.A("✅ Descarga lista", href=f"/{path}", target="_blank", style={"color": "white"}),
-            color="success"
-        )
-    except Exception as e:
-        return dbc.Alert(f"❌ Error exportando: {e}", color="danger")
-    
+
+    submit_job("export", sess["user_id"], export_task, sess["user_id"])
+    return dbc.Alert("⏳ Exportación en segundo plano", color="info", duration=3000)
 
 
 @app.callback(
     Output("import-msg", "children"),
     Input("import-upload", "contents"),
-    State("import-upload", "filename"),
+    [State("import-upload", "filename"), State("session", "data")],
     prevent_initial_call=True
 )
-def import_sensor_data(contents, filename):
-    try:
-        if contents is None:
-            raise dash.exceptions.PreventUpdate
+def import_sensor_data(contents, filename, sess):
+    if contents is None or not sess:
+        raise dash.exceptions.PreventUpdate
 
-        df = parse_csv_contents(contents, filename)
+    submit_job("import", sess["user_id"], import_task, sess["user_id"], contents, filename)
+    return dbc.Alert(f"⏳ Importando {filename} en segundo plano", color="info", duration=3000)
 
-        if df is None or df.empty:
-            return dbc.Alert("❌ Archivo vacío o inválido", color="danger")
 
-        required = {"timestamp", "bpm", "hrv", "accel_x", "accel_y", "accel_z"}
-        if not required.issubset(df.columns):
-            return dbc.Alert("❌ El CSV no tiene las columnas necesarias", color="danger")
+JOB_LABELS = {"export": "Exportación", "import": "Importación"}
+JOB_COLORS = {"queued": "secondary", "running": "info", "done": "success",
+              "error": "danger", "cancelled": "warning"}
 
-        user_id = session.get("user_id")
 
-        for _, row in df.iterrows():
-            save_sensor_data(
-                user_id=user_id,
-                bpm=row["bpm"],
-                hrv=row["hrv"],
-                accel={
-                    "x": row["accel_x"],
-                    "y": row["accel_y"],
-                    "z": row["accel_z"]
-                },
-                gyro=None
-            )
+@app.callback(
+    Output("jobs-panel", "children"),
+    [Input("auto-refresh", "n_intervals"), Input("job-cancel-msg", "children")],
+    State("session", "data")
+)
+def update_jobs_panel(n, _, sess):
+    if not sess or sess.get("rol") != "deportista":
+        return no_update
 
-        return dbc.Alert(f"✅ {len(df)} registros importados correctamente", color="success")
+    jobs = get_user_jobs(sess["user_id"])
+    if not jobs:
+        return html.Div("Sin trabajos", className="text-muted")
+
+    items = []
+    for j in jobs:
+        row = [
+            html.Small(f"{JOB_LABELS.get(j['kind'], j['kind'])} · {j['message'] or j['status']}"),
+            dbc.Progress(value=round((j["progress"] or 0) * 100), color=JOB_COLORS.get(j["status"]),
+                         striped=j["status"] == "running", className="mb-1", style={"height": "8px"}),
+        ]
+        if j["status"] in ("queued", "running"):
+            row.append(dbc.Button("Cancelar", id={"type": "job-cancel", "id": j["id"]},
+                                  size="sm", color="warning", className="mb-2"))
+        elif j["status"] == "done" and j["kind"] == "export":
+            row.append(html.A("✅ Descarga lista", href=f"/{j['result']['path']}",
+                              target="_blank", className="d-block mb-2"))
+        items.append(html.Div(row))
+    return items
 
-    except Exception as e:
-        print("❌ Error importando:", e)
-        return dbc.Alert(f"❌ Error importando: {str(e)}", color="danger")
+
+@app.callback(
+    Output("job-cancel-msg", "children"),
+    Input({"type": "job-cancel", "id": ALL}, "n_clicks"),
+    prevent_initial_call=True
+)
+def cancel_user_job(n_clicks):
+    if not ctx.triggered_id or not any(x for x in n_clicks if x):
+        return no_update
+    cancel_job(ctx.triggered_id["id"])
+    return dbc.Alert("Cancelación solicitada", color="warning", duration=2000)
 
 
 
@@ -446,27 +487,241 @@ def update_coach_view(athlete_id, n, sess):
     if not sess or sess.get("rol") != "entrenador" or not athlete_id: 
         return go.Figure(), go.Figure()
     
-    l_df = pd.DataFrame(get_training_load_history(athlete_id))
-    s_df = pd.DataFrame(get_sensor_history(athlete_id))
+    l_df = get_training_load_history(athlete_id, as_frame=True)
+    h_df = get_daily_hr_load(athlete_id, as_frame=True)
+    s_df = get_sensor_history(athlete_id, as_frame=True)
     fig1 = go.Figure(); fig2 = go.Figure()
     
     if not l_df.empty: 
-        fig1.add_trace(go.Scatter(x=pd.to_datetime(l_df.timestamp), y=l_df.load, line_color="cyan"))
+        fig1.add_trace(series_trace(l_df.timestamp, l_df.load, line_color="cyan", name="RPE × min"))
+    if not h_df.empty:
+        # Carga objetiva desde la FC (totales diarios ya agregados en la ingesta)
+        fig1.add_trace(go.Bar(x=_typed_array(_epoch_ms(h_df.day), "f8"), y=_typed_array(h_df.trimp_banister),
+                              marker_color="magenta", opacity=0.6, name="TRIMP", yaxis="y2"))
     if not s_df.empty: 
-        fig2.add_trace(go.Scatter(x=pd.to_datetime(s_df.timestamp), y=s_df.bpm, line_color="red"))
-        
-    fig1.update_layout(template="plotly_dark", title="Historial Carga"); fig2.update_layout(template="plotly_dark", title="Historial BPM")
+        fig2.add_trace(series_trace(s_df.timestamp, s_df.bpm, line_color="red"))
+
+    acwr = compute_acwr(athlete_id, source="trimp")
+    title = "Historial Carga" + (f" · ACWR TRIMP {acwr:.2f}" if acwr else "")
+    fig1.update_layout(template="plotly_dark", title=title, xaxis_type="date",
+                       yaxis2=dict(overlaying="y", side="right"))
+    fig2.update_layout(template="plotly_dark", title="Historial BPM", xaxis_type="date")
+    return fig1, fig2
+
+@app.callback(
+    [Output("coach-corr-graph", "figure"), Output("coach-rollcorr-graph", "figure")],
+    [Input("coach-athlete-select", "value"), Input("auto-refresh", "n_intervals")],
+    [State("session", "data")]
+)
+def update_coach_correlations(athlete_id, n, sess):
+    if not sess or sess.get("rol") != "entrenador" or not athlete_id:
+        return go.Figure(), go.Figure()
+
+    # Tablas memoizadas: solo se recalculan cuando hay datos nuevos
+    aligned, corr = get_analysis(athlete_id)
+    fig1 = go.Figure(); fig2 = go.Figure()
+
+    if not aligned.empty and "fatiga" in aligned:
+        fig1.add_trace(go.Scatter(x=aligned["fatiga"], y=aligned["hrv_mean"], mode="markers",
+                                  name="HRV", marker_color="cyan"))
+        fig1.add_trace(go.Scatter(x=aligned["fatiga"], y=aligned["peak_hr"], mode="markers",
+                                  name="FC pico", marker_color="red", yaxis="y2"))
+    for col in corr.columns.drop("timestamp", errors="ignore"):
+        fig2.add_trace(series_trace(corr["timestamp"], corr[col], mode="lines+markers", name=col))
+
+    fig1.update_layout(template="plotly_dark", title="Fatiga vs HRV / FC pico", xaxis_title="Fatiga",
+                       yaxis2=dict(overlaying="y", side="right"))
+    fig2.update_layout(template="plotly_dark", title="Correlación móvil", xaxis_type="date",
+                       yaxis_range=[-1, 1])
     return fig1, fig2
 
+
+@app.callback(
+    Output("coach-alerts", "children"),
+    [Input("auto-refresh", "n_intervals")],
+    [State("session", "data")]
+)
+def update_coach_alerts(n, sess):
+    if not sess or sess.get("rol") != "entrenador":
+        return no_update
+    athletes = {a["id"]: a["username"] for a in get_athletes_by_sport("baile")}
+    alerts = get_roster_alerts(list(athletes))
+    if not alerts:
+        return html.Div("Sin alertas", className="text-muted")
+    colors = {"danger": "danger", "warning": "warning"}
+    return [
+        dbc.Alert(f"{a['timestamp']} · {athletes.get(a['user_id'], a['user_id'])} · {a['message']}",
+                  color=colors.get(a["level"], "info"), className="py-1 mb-1")
+        for a in alerts
+    ]
+
 # ==========================================================
 # API SIMULADOR Y Q-FORMS
 # ==========================================================
+def after_ingest(user_id, ts, bpm=None, hrv=None):
+    """
+    Trabajo incremental por muestra ingerida: alertas y carga de FC (zonas/TRIMP).
+    """
+    fired = process_samples(user_id, ts, bpm, hrv)
+    update_hr_load(user_id, ts, bpm)
+    return fired
+
+
+SAMPLE_CHANNELS = ("bpm", "hrv", "spo2", "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z")
+
+
+def read_json_body():
+    """
+    Cuerpo JSON de la petición (gzip opcional). ValueError si no se puede decodificar:
+    es un error del cliente (400), no del servidor.
+    """
+    raw = request.get_data()
+    if request.headers.get("Content-Encoding") == "gzip":
+        try:
+            raw = gzip.decompress(raw)
+        except (OSError, EOFError, zlib.error) as e:
+            raise ValueError(f"gzip inválido: {e}")
+    try:
+        data = json.loads(raw)
+    except ValueError as e:
+        raise ValueError(f"JSON inválido: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Se esperaba un objeto JSON")
+    return data
+
+
+def _as_float(value, name):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"'{name}' no es numérico")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' no es numérico")
+
+
+def parse_sample_batch(samples):
+    """
+    Valida un lote y lo agrupa por deportista: {user_id: (ts, canales)}.
+    ValueError si falta user_id o ts, o hay valores no numéricos.
+    """
+    if not isinstance(samples, list):
+        raise ValueError("'samples' debe ser una lista")
+
+    by_user = {}
+    for i, smp in enumerate(samples):
+        if not isinstance(smp, dict) or smp.get("user_id") is None or smp.get("ts") is None:
+            raise ValueError(f"Muestra {i}: faltan user_id o ts")
+        user_id = _as_float(smp["user_id"], f"samples[{i}].user_id")
+        if not user_id.is_integer():
+            raise ValueError(f"Muestra {i}: user_id no es entero")
+        by_user.setdefault(int(user_id), []).append(smp)
+
+    parsed = {}
+    for user_id, rows in by_user.items():
+        df = pd.json_normalize(rows, sep="_")
+        try:
+            ts = df["ts"].astype(float).to_numpy()
+            channels = {c: df[c].astype(float).to_numpy() for c in SAMPLE_CHANNELS if c in df.columns}
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Valores no numéricos en el lote: {e}")
+        if not np.isfinite(ts).all():
+            raise ValueError("ts debe ser un epoch finito")
+        parsed[user_id] = (ts, channels)
+    return parsed
+
+
+def save_sample_batch(parsed):
+    """
+    Guarda con la inserción masiva el lote ya validado por parse_sample_batch.
+    """
+    n = 0
+    for user_id, (ts, channels) in parsed.items():
+        save_sensor_data_bulk(user_id, "Sim", ts, channels)
+        after_ingest(user_id, ts, channels.get("bpm"), channels.get("hrv"))
+        n += len(ts)
+    return n
+
+
+def bad_request(e):
+    return jsonify({"status": "error", "error": str(e)}), 400
+
+
 @server.route("/api/send_sensor_data", methods=["POST"])
 def api_sensor():
-    data = request.get_json()
-    save_sensor_data(user_id=data["user_id"], source="Sim", bpm=data.get("bpm"),
-                     accel_x=(data.get("accel") or {}).get("x"), accel_y=(data.get("accel") or {}).get("y"), accel_z=(data.get("accel") or {}).get("z"))
-    return jsonify({"status": "ok"})
+    # Paquetes binarios de dispositivos de alta frecuencia
+    if request.mimetype == "application/octet-stream":
+        try:
+            packet = decode_sensor_packet(request.get_data())
+        except ValueError as e:
+            return bad_request(e)
+        n = save_sensor_data_bulk(packet["user_id"], packet["source"],
+                                  packet["timestamps"], packet["channels"])
+        after_ingest(packet["user_id"], packet["timestamps"],
+                     packet["channels"].get("bpm"), packet["channels"].get("hrv"))
+        return jsonify({"status": "ok", "samples": n})
+
+    # Errores de entrada → 400 (el cliente descarta el lote); solo los fallos
+    # del servidor dan 5xx y se reintentan
+    try:
+        data = read_json_body()
+    except ValueError as e:
+        return bad_request(e)
+
+    # Lotes del cliente store-and-forward (sensors.SensorUploader)
+    if "samples" in data:
+        try:
+            parsed = parse_sample_batch(data["samples"])
+        except ValueError as e:
+            return bad_request(e)
+
+        # Se reserva la clave antes de guardar: un reintento que llega mientras
+        # el primero sigue en curso no vuelve a sumar carga ni alertas
+        key = request.headers.get("Idempotency-Key")
+        claim = claim_ingest_batch(key) if key else "claimed"
+        if claim == "done":
+            return jsonify({"status": "duplicate", "samples": 0})
+        if claim == "pending":
+            # Aún no confirmado: el cliente reintenta y, si el primero murió,
+            # la reserva caduca y el lote se vuelve a procesar
+            return jsonify({"status": "pending", "error": "Lote en curso"}), 409
+        try:
+            n = save_sample_batch(parsed)
+        except Exception:
+            if key:
+                release_ingest_batch(key)
+            raise
+        if key:
+            register_ingest_batch(key, n)
+        return jsonify({"status": "ok", "samples": n})
+
+    try:
+        if data.get("user_id") is None:
+            raise ValueError("Falta user_id")
+        user_id = _as_float(data["user_id"], "user_id")
+        if not user_id.is_integer():
+            raise ValueError("user_id no es entero")
+        user_id = int(user_id)
+        accel = data.get("accel") or {}
+        gyro = data.get("gyro") or {}
+        if not isinstance(accel, dict) or not isinstance(gyro, dict):
+            raise ValueError("accel y gyro deben ser objetos {x, y, z}")
+        values = {name: _as_float(v, name) for name, v in (
+            ("bpm", data.get("bpm")), ("hrv", data.get("hrv")),
+            ("accel_x", accel.get("x")), ("accel_y", accel.get("y")), ("accel_z", accel.get("z")),
+            ("gyro_x", gyro.get("x")), ("gyro_y", gyro.get("y")), ("gyro_z", gyro.get("z")),
+        )}
+    except ValueError as e:
+        return bad_request(e)
+
+    now = time.time()
+    save_sensor_data(user_id=user_id, source="Sim", timestamp=now, **values)
+    bpm, hrv = values["bpm"], values["hrv"]
+    fired = after_ingest(user_id, [now],
+                         [bpm] if bpm is not None else None,
+                         [hrv] if hrv is not None else None)
+    return jsonify({"status": "ok", "alerts": len(fired)})
 
 
 
@@ -0,0 +1,195 @@
+# benchmarks.py
+# Uso: python benchmarks.py [history] [ecg]
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from scipy.signal import find_peaks
+import db
+from ecg import compute_bpm_hrv
+from sensors import load_ecg_and_compute_bpm
+
+
+def _measure(fn):
+    """
+    Tiempo (sin tracemalloc, que ralentiza) y pico de memoria (en una segunda pasada).
+    """
+    t = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - t
+    del result
+
+    tracemalloc.start()
+    result = fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak / 1024 ** 2
+
+
+# --------------------------------------------------
+# Historial: lista de dicts vs columnar
+# --------------------------------------------------
+def bench_history(n_rows=1_000_000):
+    # BD temporal: se borra al acabar y se restauran las globales de db
+    saved = db.DB_PATH, db.SENSOR_STORAGE
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        db.SENSOR_STORAGE = "single"
+        try:
+            db.init_db()
+            _bench_history(n_rows)
+        finally:
+            db.DB_PATH, db.SENSOR_STORAGE = saved
+
+
+def _bench_history(n_rows):
+    rng = np.random.default_rng(0)
+    ts = time.time() - n_rows / 100 + np.arange(n_rows) / 100
+    columns = {c: rng.normal(size=n_rows) for c in
+               ("bpm", "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z")}
+    t = time.perf_counter()
+    db.save_sensor_data_bulk(1, "bench", ts, columns)
+    print(f"Inserción de {n_rows} filas: {time.perf_counter() - t:.1f} s")
+
+    def legacy():
+        df = pd.DataFrame(db.get_sensor_history(1))
+        df["timestamp"] = pd.to_datetime(df["timestamp"], format="ISO8601")
+        return df
+
+    def columnar():
+        return db.get_sensor_history(1, as_frame=True)
+
+    print(f"{'modo':<22}{'tiempo (s)':>12}{'pico RAM (MB)':>16}")
+    for name, fn in (("lista de dicts + DF", legacy), ("columnar (as_frame)", columnar)):
+        df, elapsed, peak = _measure(fn)
+        assert len(df) == n_rows
+        print(f"{name:<22}{elapsed:>12.2f}{peak:>16.0f}")
+
+
+# --------------------------------------------------
+# Detector de picos R: find_peaks crudo vs Pan-Tompkins filtrado
+# --------------------------------------------------
+ECG_TOLERANCE_S = 0.05
+ECG_WINDOW_S = 10
+
+# Plantilla de un latido: (desplazamiento s, amplitud mV, anchura s) de P, Q, R, S, T
+BEAT_WAVES = [(-0.16, 0.1, 0.025), (-0.025, -0.1, 0.01), (0.0, 1.0, 0.012),
+              (0.025, -0.2, 0.01), (0.2, 0.3, 0.04)]
+
+
+def synthetic_ecg(duration_s, fs=250, hr=(60, 120), noise=0.0, wander=0.0, artefacts=0, seed=0):
+    """
+    ECG sintético con FC que sube de hr[0] a hr[1] y vuelve (una sesión).
+    noise: ruido blanco (EMG), wander: deriva de línea base (mV),
+    artefacts: nº de ráfagas de movimiento de 2 s. Devuelve (señal, índices R reales).
+    """
+    rng = np.random.default_rng(seed)
+    n = int(duration_s * fs)
+    t = np.arange(n) / fs
+    inst_hr = hr[0] + (hr[1] - hr[0]) * 0.5 * (1 - np.cos(2 * np.pi * t / duration_s))
+    phase = np.cumsum(inst_hr / 60 / fs)
+    r_idx = np.flatnonzero(np.diff(np.floor(phase))) + 1
+
+    impulses = np.zeros(n)
+    impulses[r_idx] = rng.normal(1.0, 0.05, len(r_idx))
+    tt = np.arange(-int(0.3 * fs), int(0.3 * fs) + 1) / fs
+    template = sum(a * np.exp(-0.5 * ((tt - off) / w) ** 2) for off, a, w in BEAT_WAVES)
+    ecg = np.convolve(impulses, template, mode="same")
+
+    ecg += wander * (np.sin(2 * np.pi * 0.3 * t) + 0.5 * np.sin(2 * np.pi * 0.05 * t + 1))
+    ecg += rng.normal(0, noise, n) if noise else 0
+    burst = int(2 * fs)
+    for start in rng.integers(0, max(n - burst, 1), artefacts):
+        ecg[start:start + burst] += np.cumsum(rng.normal(0, 0.3, burst)) + rng.normal(0, 0.5, burst)
+    return ecg, r_idx
+
+
+def _legacy_peaks(ecg, fs):
+    return find_peaks(ecg, distance=fs * 0.4, prominence=0.3)[0]
+
+
+def _peak_scores(detected, truth, fs):
+    """
+    Sensibilidad y valor predictivo positivo con tolerancia de ECG_TOLERANCE_S.
+    """
+    if len(detected) == 0 or len(truth) == 0:
+        return 0.0, 0.0
+    pos = np.clip(np.searchsorted(truth, detected), 1, len(truth) - 1)
+    nearest = np.where(detected - truth[pos - 1] < truth[pos] - detected, pos - 1, pos)
+    hit = np.abs(truth[nearest] - detected) <= ECG_TOLERANCE_S * fs
+    tp = len(np.unique(nearest[hit]))
+    return tp / len(truth), tp / len(detected)
+
+
+def _window_bpm(ecg, fs, truth, legacy):
+    """
+    BPM por ventanas de ECG_WINDOW_S (como ecg_reprocess_task).
+    Devuelve (error absoluto medio, fracción de ventanas con valor).
+    """
+    win = ECG_WINDOW_S * fs
+    errors, covered, total = [], 0, 0
+    for start in range(0, len(ecg) - win + 1, win):
+        total += 1
+        bpm, _, _ = load_ecg_and_compute_bpm(pd.DataFrame({"ECG": ecg[start:start + win]}), fs, legacy=legacy)
+        r = truth[(truth >= start) & (truth < start + win)]
+        if bpm is None or len(r) < 2:
+            continue
+        covered += 1
+        errors.append(abs(bpm - 60 * fs / np.mean(np.diff(r))))
+    return (float(np.mean(errors)) if errors else np.nan), covered / max(total, 1)
+
+
+def _throughput(fn, ecg, repeat=3):
+    best = min(_timed(fn, ecg) for _ in range(repeat))
+    return len(ecg) / best
+
+
+def _timed(fn, ecg):
+    t = time.perf_counter()
+    fn(ecg)
+    return time.perf_counter() - t
+
+
+def bench_ecg(duration_s=600, fs=250):
+    example = pd.read_csv(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ecg_example.csv"))
+    fs_ex = round(1 / np.median(np.diff(example["Time"].to_numpy())))
+    print(f"ecg_example.csv ({len(example)} muestras, {fs_ex} Hz)")
+    for name, legacy in (("find_peaks crudo", True), ("Pan-Tompkins", False)):
+        bpm, hrv, _ = load_ecg_and_compute_bpm(example, fs_ex, legacy=legacy)
+        print(f"  {name:<18} bpm={bpm:.1f} hrv={hrv:.1f} ms")
+
+    cases = {
+        "limpia 60-120": dict(hr=(60, 120)),
+        "baile 80-200": dict(hr=(80, 200), noise=0.05, wander=0.5),
+        "baile + artefactos": dict(hr=(80, 200), noise=0.1, wander=0.8, artefacts=15),
+    }
+    detectors = {
+        "find_peaks crudo": (lambda x: _legacy_peaks(x, fs), True),
+        "Pan-Tompkins": (lambda x: compute_bpm_hrv(x, fs)[2], False),
+    }
+    print(f"\nSintético {duration_s} s a {fs} Hz (tolerancia {ECG_TOLERANCE_S * 1000:.0f} ms, "
+          f"ventanas de {ECG_WINDOW_S} s)")
+    print(f"{'caso':<20}{'detector':<18}{'muestras/s':>12}{'sens':>7}{'VPP':>7}"
+          f"{'err bpm':>9}{'cobertura':>11}")
+    for case, kwargs in cases.items():
+        ecg, truth = synthetic_ecg(duration_s, fs, **kwargs)
+        for name, (detect, legacy) in detectors.items():
+            sens, ppv = _peak_scores(detect(ecg), truth, fs)
+            err, coverage = _window_bpm(ecg, fs, truth, legacy)
+            print(f"{case:<20}{name:<18}{_throughput(detect, ecg):>12.0f}{sens:>7.2f}{ppv:>7.2f}"
+                  f"{err:>9.1f}{coverage:>11.0%}")
+
+
+BENCHMARKS = {
+    "history": bench_history,
+    "ecg": bench_ecg,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -2,11 +2,95 @@
 import sqlite3
 import os
 import json
+import glob
+import time
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 DB_PATH = "data/users.db"
 
+# Almacenamiento de sensor_data:
+# - "single":  todo en DB_PATH (por defecto)
+# - "athlete": un fichero SQLite por deportista
+# - "month":   un fichero SQLite por mes
+SENSOR_STORAGE = os.environ.get("SENSOR_STORAGE", "single")
+PARTITION_DIR = "data/sensor_parts"
+MAX_ATTACHED = 8  # SQLite admite 10 ATTACH por conexión por defecto
+FRAME_CHUNK_ROWS = 100000
+
+MIGRATION_CHUNK_ROWS = 50000
+
+# Un trabajo sin latido durante este tiempo pertenece a un proceso muerto
+JOB_HEARTBEAT_S = 15
+JOB_STALE_S = 120
+
+# Reserva de Idempotency-Key sin confirmar: pasado este tiempo el proceso que
+# la hizo se da por muerto y un reintento puede volver a reservarla
+INGEST_CLAIM_STALE_S = 120
+
+# ts: entero en microsegundos desde epoch (UTC). Tabla agrupada por (user_id, ts):
+# las lecturas por deportista y rango de fechas son un recorrido secuencial de la clave.
+SENSOR_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS sensor_data (
+        user_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        source TEXT NOT NULL DEFAULT '',
+        bpm REAL,
+        spo2 REAL,
+        accel_x REAL,
+        accel_y REAL,
+        accel_z REAL,
+        gyro_x REAL,
+        gyro_y REAL,
+        gyro_z REAL,
+        hrv REAL,
+        PRIMARY KEY (user_id, ts, source)
+    ) WITHOUT ROWID
+"""
+
+SENSOR_INSERT_SQL = """
+    INSERT OR REPLACE INTO sensor_data
+    (user_id, ts, source, bpm, spo2, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z, hrv)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+SENSOR_VALUE_COLUMNS = [
+    "bpm", "spo2", "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z", "hrv"
+]
+
+# Estado incremental por deportista (carga de FC y alertas)
+STATE_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS daily_hr_load (
+        user_id INTEGER,
+        day TEXT,
+        z1_s REAL DEFAULT 0,
+        z2_s REAL DEFAULT 0,
+        z3_s REAL DEFAULT 0,
+        z4_s REAL DEFAULT 0,
+        z5_s REAL DEFAULT 0,
+        trimp_banister REAL DEFAULT 0,
+        trimp_edwards REAL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS hr_load_state (
+        user_id INTEGER PRIMARY KEY,
+        last_ts REAL,
+        last_bpm REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS alert_state (
+        user_id INTEGER PRIMARY KEY,
+        state TEXT
+    )
+    """,
+]
+STATE_TABLES = ["daily_hr_load", "hr_load_state", "alert_state"]
+
 
 # -------------------------------------------------
 # Inicialización
@@ -14,6 +98,8 @@ DB_PATH = "data/users.db"
 def init_db():
     os.makedirs("data", exist_ok=True)
     conn = sqlite3.connect(DB_PATH)
+    # WAL: las lecturas del dashboard no bloquean las escrituras de la ingesta
+    conn.execute("PRAGMA journal_mode=WAL")
     c = conn.cursor()
 
     c.execute("""
@@ -37,26 +123,57 @@ def init_db():
     )
     """)
 
+    _init_sensor_schema(conn)
+
     c.execute("""
-    CREATE TABLE IF NOT EXISTS sensor_data (
+    CREATE TABLE IF NOT EXISTS alerts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        rule TEXT,
+        level TEXT,
+        message TEXT,
+        value REAL,
         timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        dedup_key TEXT UNIQUE
+    )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_user_ts ON alerts (user_id, timestamp)")
+
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
         user_id INTEGER,
-        source TEXT,
-        bpm REAL,
-        spo2 REAL,
-        accel_x REAL,
-        accel_y REAL,
-        accel_z REAL,
-        gyro_x REAL,
-        gyro_y REAL,
-        gyro_z REAL
+        kind TEXT,
+        status TEXT,
+        progress REAL DEFAULT 0,
+        message TEXT,
+        result TEXT,
+        cancel_requested INTEGER DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
     )
     """)
 
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS ingest_batches (
+        idempotency_key TEXT PRIMARY KEY,
+        samples INTEGER,
+        received_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    for sql in STATE_TABLES_SQL:
+        c.execute(sql)
+
+    if SENSOR_STORAGE != "single":
+        os.makedirs(PARTITION_DIR, exist_ok=True)
+
     conn.commit()
     conn.close()
 
+    # Trabajos de un proceso anterior que murió sin terminarlos
+    fail_stale_jobs(JOB_STALE_S)
+
 
 # -------------------------------------------------
 # Usuarios
@@ -91,6 +208,15 @@ def authenticate_user(username, password):
     return None
 
 
+def get_user_age(user_id):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT edad FROM users WHERE id=?", (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
 def get_athletes_by_sport(deporte):
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
@@ -117,10 +243,7 @@ def save_questionnaire(user_id, questionnaire_id, responses):
     conn.close()
 
 
-def get_questionnaire_history(user_id, questionnaire_id=None, days=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-
+def _questionnaire_query(user_id, questionnaire_id=None, days=None):
     query = "SELECT questionnaire_id, responses, timestamp FROM questionnaires WHERE user_id=?"
     params = [user_id]
 
@@ -134,6 +257,32 @@ def get_questionnaire_history(user_id, questionnaire_id=None, days=None):
         params.append(since)
 
     query += " ORDER BY timestamp"
+    return query, params
+
+
+def get_questionnaire_frame(user_id, questionnaire_id=None, days=None, parse_dates=True):
+    """
+    Cuestionarios en columnas: una columna por clave de respuesta.
+    """
+    query, params = _questionnaire_query(user_id, questionnaire_id, days)
+    conn = sqlite3.connect(DB_PATH)
+    df = pd.read_sql_query(
+        query, conn, params=params,
+        parse_dates={"timestamp": {"format": "ISO8601"}} if parse_dates else None
+    )
+    conn.close()
+
+    responses = pd.DataFrame([json.loads(r) for r in df.pop("responses")], index=df.index)
+    return df.join(responses)
+
+
+def get_questionnaire_history(user_id, questionnaire_id=None, days=None, as_frame=False):
+    if as_frame:
+        return get_questionnaire_frame(user_id, questionnaire_id, days)
+
+    query, params = _questionnaire_query(user_id, questionnaire_id, days)
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
     c.execute(query, params)
 
     rows = c.fetchall()
@@ -163,32 +312,477 @@ def compute_session_load_from_responses(responses):
         return None
 
 
-def get_training_load_history(user_id, days=None):
-    history = get_questionnaire_history(user_id, questionnaire_id="general", days=days)
-    loads = []
-    for h in history:
-        rpe = h["responses"].get("rpe")
-        dur = h["responses"].get("duracion_min")
-        if rpe is not None and dur is not None:
-            loads.append({
-                "timestamp": h["timestamp"],
-                "load": float(rpe) * float(dur)
-            })
-    return loads
+def get_training_load_history(user_id, days=None, as_frame=False):
+    df = get_questionnaire_frame(user_id, questionnaire_id="general", days=days, parse_dates=as_frame)
+    if "rpe" in df.columns and "duracion_min" in df.columns:
+        rpe = pd.to_numeric(df["rpe"], errors="coerce").astype(float)
+        df["load"] = rpe * pd.to_numeric(df["duracion_min"], errors="coerce")
+        df = df.dropna(subset=["load"])[["timestamp", "load"]].reset_index(drop=True)
+    else:
+        df = pd.DataFrame(columns=["timestamp", "load"])
+    return df if as_frame else df.to_dict("records")
+
+
 
+HR_LOAD_COLUMNS = [
+    "z1_s", "z2_s", "z3_s", "z4_s", "z5_s", "trimp_banister", "trimp_edwards"
+]
 
 
-def compute_acwr(user_id, acute_days=7, chronic_days=28):
-    acute = get_training_load_history(user_id, acute_days)
-    chronic = get_training_load_history(user_id, chronic_days)
+def _add_daily_hr_load(conn, user_id, daily):
+    """
+    Suma los totales de `daily` (DataFrame por día) a la tabla daily_hr_load.
+    """
+    cols = ", ".join(HR_LOAD_COLUMNS)
+    marks = ", ".join("?" * len(HR_LOAD_COLUMNS))
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in HR_LOAD_COLUMNS)
+    rows = [
+        (user_id, r[0], *map(float, r[1:]))
+        for r in daily[["day"] + HR_LOAD_COLUMNS].itertuples(index=False)
+    ]
+    conn.executemany(f"""
+        INSERT INTO daily_hr_load (user_id, day, {cols}) VALUES (?, ?, {marks})
+        ON CONFLICT (user_id, day) DO UPDATE SET {updates}
+    """, rows)
+
+
+def _save_hr_load_state(conn, user_id, last):
+    if last is None:
+        conn.execute("DELETE FROM hr_load_state WHERE user_id=?", (user_id,))
+    else:
+        conn.execute(
+            "INSERT OR REPLACE INTO hr_load_state (user_id, last_ts, last_bpm) VALUES (?, ?, ?)",
+            (user_id, *last)
+        )
+
 
-    a = [d["load"] for d in acute]
-    c = [d["load"] for d in chronic]
+def update_daily_hr_load(user_id, evaluate):
+    """
+    Carga incremental en una transacción: lee la última muestra contada,
+    evaluate(último (ts, bpm) o None) -> (daily, nuevo último o None) y suma.
+    """
+    def work(conn):
+        last = conn.execute(
+            "SELECT last_ts, last_bpm FROM hr_load_state WHERE user_id=?", (user_id,)
+        ).fetchone()
+        daily, new_last = evaluate(last)
+        if daily is not None and not daily.empty:
+            _add_daily_hr_load(conn, user_id, daily)
+        if new_last is not None:
+            _save_hr_load_state(conn, user_id, new_last)
 
-    if not a or not c:
+    _state_transaction(user_id, work)
+
+
+def replace_daily_hr_load(user_id, daily, last, evaluate):
+    """
+    Sustituye el histórico diario y el estado en una sola transacción.
+    `daily` y `last` se calculan fuera del lock hasta una marca de agua (la
+    última muestra contada); con el lock tomado, evaluate(last) -> (daily,
+    nuevo último o None) suma solo lo llegado después, como update_daily_hr_load.
+    Devuelve el nº de días del histórico.
+    """
+    def work(conn):
+        conn.execute("DELETE FROM daily_hr_load WHERE user_id=?", (user_id,))
+        if not daily.empty:
+            _add_daily_hr_load(conn, user_id, daily)
+        tail, new_last = evaluate(last)
+        if tail is not None and not tail.empty:
+            _add_daily_hr_load(conn, user_id, tail)
+        _save_hr_load_state(conn, user_id, new_last if new_last is not None else last)
+        return conn.execute(
+            "SELECT COUNT(*) FROM daily_hr_load WHERE user_id=?", (user_id,)
+        ).fetchone()[0]
+
+    return _state_transaction(user_id, work)
+
+
+def get_daily_hr_load(user_id, days=None, as_frame=False):
+    query = f"SELECT day, {', '.join(HR_LOAD_COLUMNS)} FROM daily_hr_load WHERE user_id=?"
+    params = [user_id]
+
+    if days:
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+        query += " AND day > ?"
+        params.append(since)
+
+    query += " ORDER BY day"
+    conn = _connect_state(user_id)
+    df = pd.read_sql_query(query, conn, params=params, parse_dates=["day"] if as_frame else None)
+    conn.close()
+    return df if as_frame else df.to_dict("records")
+
+
+def compute_acwr(user_id, acute_days=7, chronic_days=28, source="rpe"):
+    """
+    source="rpe": media de carga por sesión (rpe * duración)
+    source="trimp": carga diaria objetiva de FC (TRIMP Banister), días sin datos = 0
+    """
+    if source == "trimp":
+        daily = get_daily_hr_load(user_id, chronic_days, as_frame=True)
+        if daily.empty:
+            return None
+        cutoff = pd.Timestamp(datetime.now(timezone.utc).date()) - pd.Timedelta(days=acute_days)
+        acute = daily.loc[daily["day"] > cutoff, "trimp_banister"].sum() / acute_days
+        chronic = daily["trimp_banister"].sum() / chronic_days
+        return float(acute / chronic) if chronic > 0 else None
+
+    a = get_training_load_history(user_id, acute_days, as_frame=True)["load"]
+    c = get_training_load_history(user_id, chronic_days, as_frame=True)["load"]
+
+    if a.empty or c.empty:
         return None
 
-    return sum(a) / len(a) / (sum(c) / len(c))
+    return float(a.mean() / c.mean())
+
+
+# -------------------------------------------------
+# Marcas de tiempo de sensor_data (µs desde epoch)
+# -------------------------------------------------
+US = 1_000_000
+
+
+def now_us():
+    return int(time.time() * US)
+
+
+def to_epoch_us(value):
+    """
+    Marca de tiempo → entero en µs desde epoch.
+    Acepta epoch en segundos, datetime / pd.Timestamp / datetime64 y texto ISO.
+    Las fechas naive son UTC (como CURRENT_TIMESTAMP y los datos migrados),
+    igual que en to_epoch_us_array.
+    """
+    if isinstance(value, (str, datetime, np.datetime64)):
+        return int(to_epoch_us_array([value])[0])
+    return round(float(value) * US)
+
+
+def to_epoch_us_array(values):
+    """
+    Versión vectorizada: epoch en segundos (array numérico) o fechas
+    (datetime64, datetime o texto ISO; naive = UTC).
+    """
+    arr = np.asarray(values)
+    if arr.dtype.kind in "iuf":
+        return np.round(arr.astype(float) * US).astype(np.int64)
+    if arr.dtype.kind in "US" or (arr.dtype == object and len(arr) and isinstance(arr[0], str)):
+        stamps = pd.to_datetime(arr, format="ISO8601", utc=True)
+    else:
+        stamps = pd.to_datetime(arr, utc=True)
+    return np.asarray((stamps - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(microseconds=1), dtype=np.int64)
+
+
+def _us_to_str(ts_us):
+    # Texto ISO en UTC para las salidas en lista de dicts
+    stamps = np.asarray(ts_us, dtype=np.int64).astype("datetime64[us]")
+    return np.char.replace(np.datetime_as_string(stamps), "T", " ").tolist()
+
+
+def _month_keys(ts_us):
+    months = np.asarray(ts_us, dtype=np.int64).astype("datetime64[us]").astype("datetime64[M]")
+    return np.char.replace(np.datetime_as_string(months), "-", "_")
+
+
+# -------------------------------------------------
+# Particiones de sensor_data
+# -------------------------------------------------
+_ready_partitions = set()
+
+
+def _init_sensor_schema(conn):
+    existing = {r[1] for r in conn.execute("PRAGMA table_info(sensor_data)")}
+    if existing and "ts" not in existing:
+        _migrate_sensor_timestamps(conn, existing)
+    conn.execute(SENSOR_TABLE_SQL)
+
+
+def _migrate_sensor_timestamps(conn, existing, batch_size=MIGRATION_CHUNK_ROWS):
+    """
+    Esquema antiguo (id + timestamp en texto) → tabla WITHOUT ROWID con ts en µs.
+    Se copia por bloques dentro de una sola transacción; el texto naive es UTC
+    (CURRENT_TIMESTAMP). Las muestras de un deportista que caían en el mismo
+    instante se separan 1 µs, en orden de llegada, para no chocar en la clave.
+    """
+    names = ["user_id", "timestamp", "source"] + SENSOR_VALUE_COLUMNS
+    select = ", ".join(c if c in existing else "NULL" for c in names)
+
+    conn.commit()
+    conn.execute("BEGIN")
+    conn.execute("ALTER TABLE sensor_data RENAME TO sensor_data_legacy")
+    conn.execute(SENSOR_TABLE_SQL)
+    cur = conn.execute(
+        f"SELECT {select} FROM sensor_data_legacy ORDER BY user_id, timestamp, rowid"
+    )
+
+    migrated = 0
+    prev = None  # (user_id, ts, repetición) de la última fila del bloque anterior
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        df = pd.DataFrame.from_records(rows, columns=names)
+        stamps = pd.to_datetime(df.pop("timestamp"), format="ISO8601", utc=True, errors="coerce")
+        keep = (stamps.notna() & df["user_id"].notna()).to_numpy()
+        if not keep.any():
+            continue
+        df = df[keep]
+        user = df["user_id"].to_numpy(dtype=np.int64)
+        ts = to_epoch_us_array(stamps[keep])
+
+        new = np.ones(len(df), dtype=bool)
+        new[1:] = (user[1:] != user[:-1]) | (ts[1:] != ts[:-1])
+        run = np.cumsum(new) - 1
+        rep = np.arange(len(df)) - np.flatnonzero(new)[run]
+        if prev is not None and (user[0], ts[0]) == prev[:2]:
+            rep[run == 0] += prev[2] + 1
+        prev = (user[-1], ts[-1], rep[-1])
+
+        conn.executemany(SENSOR_INSERT_SQL.replace("OR REPLACE", "OR IGNORE"), zip(
+            user.tolist(), (ts + rep).tolist(), df["source"].fillna("").tolist(),
+            *(df[c].tolist() for c in SENSOR_VALUE_COLUMNS)
+        ))
+        migrated += len(df)
+
+    conn.execute("DROP TABLE sensor_data_legacy")
+    conn.commit()
+    return migrated
+
+
+def _sensor_partition_path(user_id, ts=None):
+    """
+    Fichero donde se escribe una muestra según SENSOR_STORAGE (ts en µs).
+    """
+    if SENSOR_STORAGE == "athlete":
+        return os.path.join(PARTITION_DIR, f"athlete_{int(user_id)}.db")
+    if SENSOR_STORAGE == "month":
+        month = _month_keys([now_us() if ts is None else ts])[0]
+        return os.path.join(PARTITION_DIR, f"month_{month}.db")
+    return DB_PATH
+
+
+def _sensor_partitions(user_id=None, since=None):
+    """
+    Ficheros que pueden contener filas para el filtro dado (since en µs).
+    """
+    if SENSOR_STORAGE == "athlete":
+        if user_id is not None:
+            path = _sensor_partition_path(user_id)
+            return [path] if os.path.exists(path) else []
+        return sorted(glob.glob(os.path.join(PARTITION_DIR, "athlete_*.db")))
+
+    if SENSOR_STORAGE == "month":
+        paths = sorted(glob.glob(os.path.join(PARTITION_DIR, "month_*.db")))
+        if since is not None:
+            first = os.path.basename(_sensor_partition_path(None, since))
+            paths = [p for p in paths if os.path.basename(p) >= first]
+        return paths
+
+    return [DB_PATH]
+
+
+def _group_by_partition(rows, ts_us, user_ids):
+    """
+    Reparte filas entre ficheros de partición: [(ruta, filas), ...].
+    """
+    if SENSOR_STORAGE == "month":
+        keys, inverse = np.unique(_month_keys(ts_us), return_inverse=True)
+        paths = [os.path.join(PARTITION_DIR, f"month_{k}.db") for k in keys]
+    elif SENSOR_STORAGE == "athlete":
+        keys, inverse = np.unique(np.asarray(user_ids, dtype=np.int64), return_inverse=True)
+        paths = [_sensor_partition_path(k) for k in keys]
+    else:
+        return [(DB_PATH, rows)]
+
+    if len(paths) == 1:
+        return [(paths[0], rows)]
+    groups = [[] for _ in paths]
+    for i, row in zip(inverse.tolist(), rows):
+        groups[i].append(row)
+    return list(zip(paths, groups))
+
+
+def _connect_sensor_write(path):
+    """
+    Conexión de escritura a una partición; crea (o migra) el esquema la primera vez.
+    Cada partición tiene su propio lock, así que deportistas distintos no se bloquean.
+    """
+    if path not in _ready_partitions:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    if path not in _ready_partitions:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _init_sensor_schema(conn)
+        conn.commit()
+        _ready_partitions.add(path)
+    return conn
+
+
+# -------------------------------------------------
+# Estado incremental por deportista
+# -------------------------------------------------
+_ready_state_dbs = set()
+
+
+def _state_db_path(user_id):
+    """
+    Fichero con el estado que se escribe en cada ingesta (alertas, carga de FC).
+    En SENSOR_STORAGE="athlete" va junto a sus muestras, con su propio lock;
+    en "single" y "month" queda en users.db (en WAL).
+    """
+    if SENSOR_STORAGE == "athlete":
+        return _sensor_partition_path(user_id)
+    return DB_PATH
+
+
+def _connect_state(user_id):
+    path = _state_db_path(user_id)
+    if path == DB_PATH:
+        return sqlite3.connect(DB_PATH, timeout=30)
+
+    conn = _connect_sensor_write(path)
+    if path not in _ready_state_dbs:
+        existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        for sql in STATE_TABLES_SQL:
+            conn.execute(sql)
+        # Primera vez en esta partición: se trae el estado que hubiera en users.db
+        if not existing.issuperset(STATE_TABLES) and os.path.exists(DB_PATH):
+            conn.execute("ATTACH DATABASE ? AS users", (DB_PATH,))
+            in_users = {r[0] for r in conn.execute("SELECT name FROM users.sqlite_master WHERE type='table'")}
+            for table in STATE_TABLES:
+                if table in in_users:
+                    conn.execute(f"INSERT OR IGNORE INTO main.{table} SELECT * FROM users.{table} WHERE user_id=?",
+                                 (user_id,))
+            conn.commit()
+            conn.execute("DETACH DATABASE users")
+        conn.commit()
+        _ready_state_dbs.add(path)
+    return conn
+
+
+def _state_transaction(user_id, work):
+    """
+    Ejecuta work(conn) en una transacción BEGIN IMMEDIATE sobre el fichero de
+    estado del deportista (lectura-modificación-escritura sin carreras).
+    """
+    conn = _connect_state(user_id)
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        result = work(conn)
+        conn.execute("COMMIT")
+        return result
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _sensor_batches(columns, where="1=1", params=(), user_id=None, since=None, paths=None):
+    """
+    Genera (conexión, sql, parámetros) por grupo de particiones (ATTACH bajo demanda).
+    `columns` debe empezar por ts; cada SELECT va ordenado por él.
+    """
+    if paths is None:
+        paths = _sensor_partitions(user_id, since)
+    for path in paths:
+        if path not in _ready_partitions:
+            _connect_sensor_write(path).close()
+
+    if paths == [DB_PATH]:
+        conn = sqlite3.connect(DB_PATH)
+        yield conn, f"SELECT {columns} FROM sensor_data WHERE {where} ORDER BY ts", list(params)
+        conn.close()
+        return
+
+    for i in range(0, len(paths), MAX_ATTACHED):
+        batch = paths[i:i + MAX_ATTACHED]
+        conn = sqlite3.connect(":memory:")
+        for j, path in enumerate(batch):
+            conn.execute(f"ATTACH DATABASE ? AS p{j}", (path,))
+        union = " UNION ALL ".join(
+            f"SELECT {columns} FROM p{j}.sensor_data WHERE {where}" for j in range(len(batch))
+        )
+        yield conn, f"SELECT * FROM ({union}) ORDER BY ts", list(params) * len(batch)
+        conn.close()
+
+
+def _query_sensor_partitions(columns, where="1=1", params=(), user_id=None, since=None, paths=None):
+    """
+    Filas (tuplas) de todas las particiones relevantes, ordenadas por ts.
+    """
+    rows = []
+    batches = 0
+    for conn, sql, batch_params in _sensor_batches(columns, where, params, user_id, since, paths):
+        rows.extend(conn.execute(sql, batch_params).fetchall())
+        batches += 1
+    if batches > 1:
+        rows.sort(key=lambda r: r[0])
+    return rows
+
+
+def _read_sensor_frame(columns, where="1=1", params=(), user_id=None, since=None, parse_dates=True):
+    """
+    Igual que _query_sensor_partitions pero en columnas: DataFrame construido
+    directamente desde el cursor. ts se devuelve como columna `timestamp`:
+    datetime64 naive en UTC, o el entero en µs si parse_dates=False.
+    """
+    names = [c.strip() for c in columns.split(",")]
+    dtypes = {c: "float64" for c in names if c in SENSOR_FLOAT_COLUMNS}
+    dtypes["ts"] = "int64"
+    frames = []
+    for conn, sql, batch_params in _sensor_batches(columns, where, params, user_id, since):
+        # Por bloques: las tuplas de Python de cada bloque se liberan antes del siguiente
+        frames.extend(pd.read_sql_query(
+            sql, conn, params=batch_params, dtype=dtypes, chunksize=FRAME_CHUNK_ROWS
+        ))
+    if not frames:
+        df = pd.DataFrame({c: pd.Series(dtype=dtypes.get(c, object)) for c in names})
+    elif len(frames) == 1:
+        df = frames[0]
+    else:
+        df = pd.concat(frames, ignore_index=True)
+        if not df["ts"].is_monotonic_increasing:
+            df = df.sort_values("ts", ignore_index=True)
+
+    ts = df.pop("ts")
+    df.insert(0, "timestamp", pd.to_datetime(ts, unit="us") if parse_dates else ts)
+    return df
+
+
+def migrate_sensor_data_to_partitions(batch_size=MIGRATION_CHUNK_ROWS):
+    """
+    Mueve las filas de sensor_data de DB_PATH a las particiones configuradas.
+    Se puede relanzar: las filas ya copiadas se sobrescriben (misma clave primaria).
+    """
+    if SENSOR_STORAGE == "single":
+        return 0
+
+    src = sqlite3.connect(DB_PATH)
+    _init_sensor_schema(src)
+    cur = src.execute(
+        f"SELECT user_id, ts, source, {', '.join(SENSOR_VALUE_COLUMNS)} FROM sensor_data"
+    )
+    moved = 0
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        ts = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        users = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        for path, group in _group_by_partition(rows, ts, users):
+            conn = _connect_sensor_write(path)
+            conn.executemany(SENSOR_INSERT_SQL, group)
+            conn.commit()
+            conn.close()
+        moved += len(rows)
+
+    src.execute("DELETE FROM sensor_data")
+    src.commit()
+    src.close()
+    return moved
 
 
 # -------------------------------------------------
@@ -204,36 +798,264 @@ def save_sensor_data(
     accel_z=None,
     gyro_x=None,
     gyro_y=None,
-    gyro_z=None
+    gyro_z=None,
+    hrv=None,
+    timestamp=None
 ):
-    conn = sqlite3.connect(DB_PATH)
+    """
+    timestamp: epoch en segundos, datetime o texto ISO (por defecto, ahora).
+    """
+    ts = now_us() if timestamp is None else to_epoch_us(timestamp)
+    conn = _connect_sensor_write(_sensor_partition_path(user_id, ts))
     c = conn.cursor()
-    c.execute("""
-        INSERT INTO sensor_data
-        (user_id, source, bpm, spo2, accel_x, accel_y, accel_z, gyro_x, gyro_y, gyro_z)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        user_id, source, bpm, spo2,
+    c.execute(SENSOR_INSERT_SQL, (
+        user_id, ts, source or "", bpm, spo2,
         accel_x, accel_y, accel_z,
-        gyro_x, gyro_y, gyro_z
+        gyro_x, gyro_y, gyro_z, hrv
     ))
     conn.commit()
     conn.close()
 
 
-def get_sensor_history(user_id, days=None):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+def _spread_duplicate_ts(ts):
+    """
+    Marcas repetidas dentro de un lote se separan 1 µs, en orden de llegada
+    (como en la migración): con INSERT OR REPLACE solo quedaría la última.
+    """
+    while True:
+        order = np.argsort(ts, kind="stable")
+        s = ts[order]
+        new = np.ones(len(s), dtype=bool)
+        new[1:] = s[1:] != s[:-1]
+        if new.all():
+            return ts
+        first = np.flatnonzero(new)
+        rep = np.arange(len(s)) - first[np.cumsum(new) - 1]
+        ts = np.empty_like(s)
+        ts[order] = s + rep
+
+
+def save_sensor_data_bulk(user_id, source, timestamps, columns):
+    """
+    Inserción masiva de muestras (p.ej. paquetes binarios a 100-1000 Hz).
+    timestamps: epoch en segundos (array) o fechas (datetime64 / texto ISO, naive = UTC)
+    columns: {"bpm": array, "accel_x": array, ...}
+    """
+    n = len(timestamps)
+    if n == 0:
+        return 0
+
+    ts = _spread_duplicate_ts(to_epoch_us_array(timestamps))
+    cols = [np.asarray(columns[k], dtype=float).tolist() if k in columns else [None] * n
+            for k in SENSOR_VALUE_COLUMNS]
+    rows = list(zip([user_id] * n, ts.tolist(), [source or ""] * n, *cols))
+
+    for path, batch in _group_by_partition(rows, ts, [user_id]):
+        conn = _connect_sensor_write(path)
+        conn.executemany(SENSOR_INSERT_SQL, batch)
+        conn.commit()
+        conn.close()
+    return n
+
+
+SENSOR_COLUMNS = "ts, " + ", ".join(SENSOR_VALUE_COLUMNS)
+SENSOR_COLUMN_NAMES = ["timestamp"] + SENSOR_VALUE_COLUMNS
+SENSOR_FLOAT_COLUMNS = set(SENSOR_VALUE_COLUMNS)
+
 
-    query = "SELECT timestamp, bpm, spo2, accel_x, accel_y, accel_z FROM sensor_data WHERE user_id=?"
+def _sensor_filter(user_id, days=None, start=None, end=None):
+    where = "user_id=?"
     params = [user_id]
+    since = None
 
     if days:
-        since = datetime.now() - timedelta(days=days)
+        since = now_us() - int(days * 86400 * US)
+    if start is not None:
+        since = start if since is None else max(since, start)
+    if since is not None:
+        where += " AND ts >= ?"
+        params.append(since)
+    if end is not None:
+        where += " AND ts <= ?"
+        params.append(end)
+
+    return where, params, since
+
+
+def get_sensor_frame(user_id, days=None, parse_dates=True, start=None, end=None):
+    """
+    Historial de sensores en columnas (DataFrame con timestamp ya convertido).
+    `start` / `end` (µs desde epoch, inclusivos) acotan el rango leído.
+    """
+    where, params, since = _sensor_filter(user_id, days, start, end)
+    return _read_sensor_frame(SENSOR_COLUMNS, where, params, user_id=user_id,
+                              since=since, parse_dates=parse_dates)
+
+
+def get_sensor_history(user_id, days=None, as_frame=False):
+    """
+    as_frame=True devuelve el DataFrame columnar; si no, la lista de dicts de siempre
+    (timestamp como texto ISO en UTC).
+    """
+    if as_frame:
+        return get_sensor_frame(user_id, days)
+
+    where, params, since = _sensor_filter(user_id, days)
+    rows = _query_sensor_partitions(SENSOR_COLUMNS, where, params, user_id=user_id, since=since)
+    names = SENSOR_COLUMN_NAMES
+    stamps = _us_to_str([r[0] for r in rows])
+    return [dict(zip(names, (s, *r[1:]))) for s, r in zip(stamps, rows)]
+
+
+def claim_ingest_batch(key, stale_s=INGEST_CLAIM_STALE_S):
+    """
+    Reserva el Idempotency-Key antes de procesar el lote.
+    Devuelve "claimed" (hay que guardarlo), "done" (ya se guardó) o "pending"
+    (otra petición lo está guardando). Una reserva sin confirmar de hace más
+    de `stale_s` segundos se vuelve a reservar: el proceso que la hizo murió.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        c = conn.execute("INSERT OR IGNORE INTO ingest_batches (idempotency_key) VALUES (?)", (key,))
+        if c.rowcount == 0:
+            c = conn.execute("""
+                UPDATE ingest_batches SET received_at=CURRENT_TIMESTAMP
+                WHERE idempotency_key=? AND samples IS NULL
+                  AND received_at < datetime('now', ?)
+            """, (key, f"-{int(stale_s)} seconds"))
+        if c.rowcount > 0:
+            state = "claimed"
+        else:
+            samples = conn.execute(
+                "SELECT samples FROM ingest_batches WHERE idempotency_key=?", (key,)
+            ).fetchone()[0]
+            state = "pending" if samples is None else "done"
+        conn.execute("COMMIT")
+        return state
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def release_ingest_batch(key):
+    # El lote falló: se libera la reserva para que el reintento lo procese
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute("DELETE FROM ingest_batches WHERE idempotency_key=?", (key,))
+    conn.commit()
+    conn.close()
+
+
+def register_ingest_batch(key, samples):
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute(
+        "UPDATE ingest_batches SET samples=? WHERE idempotency_key=?",
+        (samples, key)
+    )
+    conn.commit()
+    conn.close()
+
+
+def get_team_sensor_history(user_ids, days=None):
+    """
+    Historial de varios deportistas a la vez (vista coreógrafo).
+    Funciona igual con una sola DB que con particiones.
+    """
+    user_ids = [int(u) for u in user_ids]
+    if not user_ids:
+        return []
+
+    where = f"user_id IN ({','.join('?' * len(user_ids))})"
+    params = list(user_ids)
+    since = None
+
+    if days:
+        since = now_us() - int(days * 86400 * US)
+        where += " AND ts >= ?"
+        params.append(since)
+
+    paths = None
+    if SENSOR_STORAGE == "athlete":
+        # Solo se adjuntan los ficheros de los deportistas pedidos
+        wanted = {_sensor_partition_path(u) for u in user_ids}
+        paths = [p for p in _sensor_partitions() if p in wanted]
+
+    rows = _query_sensor_partitions(
+        "ts, user_id, bpm, spo2, accel_x, accel_y, accel_z",
+        where, params, since=since, paths=paths
+    )
+    stamps = _us_to_str([r[0] for r in rows])
+
+    return [
+        {
+            "timestamp": s,
+            "user_id": r[1],
+            "bpm": r[2],
+            "spo2": r[3],
+            "accel_x": r[4],
+            "accel_y": r[5],
+            "accel_z": r[6]
+        }
+        for s, r in zip(stamps, rows)
+    ]
+
+
+def get_questionnaire_span(user_id):
+    """
+    (nº de cuestionarios, último id, primer y último timestamp) de un deportista.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute(
+        "SELECT COUNT(*), MAX(id), MIN(timestamp), MAX(timestamp) FROM questionnaires WHERE user_id=?",
+        (user_id,)
+    )
+    span = c.fetchone()
+    conn.close()
+    return span
+
+
+def get_sensor_version(user_id, start=None, end=None):
+    """
+    Huella barata de las muestras de un deportista en [start, end] (µs):
+    (nº de muestras, última ts). Sirve para invalidar cachés sin que las
+    muestras fuera del rango las invaliden.
+    """
+    where, params, since = _sensor_filter(user_id, start=start, end=end)
+    rows = _query_sensor_partitions(
+        "MAX(ts) AS ts, COUNT(*)", where, params, user_id=user_id, since=since
+    )
+    last = max((r[0] for r in rows if r[0] is not None), default=None)
+    return (sum(r[1] for r in rows), last)
+
+
+# -------------------------------------------------
+# Alertas
+# -------------------------------------------------
+def get_alerts(user_ids, since=None, limit=50):
+    user_ids = [int(u) for u in user_ids]
+    if not user_ids:
+        return []
+
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+
+    query = f"""
+        SELECT user_id, rule, level, message, value, timestamp FROM alerts
+        WHERE user_id IN ({','.join('?' * len(user_ids))})
+    """
+    params = list(user_ids)
+
+    if since:
         query += " AND timestamp >= ?"
         params.append(since)
 
-    query += " ORDER BY timestamp"
+    query += " ORDER BY timestamp DESC LIMIT ?"
+    params.append(limit)
     c.execute(query, params)
 
     rows = c.fetchall()
@@ -241,35 +1063,248 @@ def get_sensor_history(user_id, days=None):
 
     return [
         {
-            "timestamp": r[0],
-            "bpm": r[1],
-            "spo2": r[2],
-            "accel_x": r[3],
-            "accel_y": r[4],
-            "accel_z": r[5]
+            "user_id": r[0],
+            "rule": r[1],
+            "level": r[2],
+            "message": r[3],
+            "value": r[4],
+            "timestamp": r[5]
         }
         for r in rows
     ]
 
 
+def get_alert_state(user_id):
+    conn = _connect_state(user_id)
+    c = conn.cursor()
+    c.execute("SELECT state FROM alert_state WHERE user_id=?", (user_id,))
+    row = c.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def _insert_alerts(conn, user_id, candidates):
+    """
+    INSERT OR IGNORE de las alertas candidatas; devuelve las nuevas (sin dedup_key).
+    """
+    fired = []
+    for a in candidates:
+        cur = conn.execute("""
+            INSERT OR IGNORE INTO alerts (user_id, rule, level, message, value, timestamp, dedup_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (user_id, a["rule"], a["level"], a["message"], a["value"], a["timestamp"], a["dedup_key"]))
+        if cur.rowcount > 0:
+            fired.append({k: v for k, v in a.items() if k != "dedup_key"})
+    return fired
+
+
+def update_alert_state(user_id, evaluate):
+    """
+    Lee, evalúa y guarda el estado de alertas de un deportista en una sola
+    transacción: ingestas simultáneas del mismo deportista se serializan
+    en vez de pisarse las EWMA y los episodios.
+    evaluate(estado o None) -> (estado nuevo, alertas candidatas con dedup_key).
+    Devuelve solo las alertas insertadas (las repetidas se ignoran).
+
+    Con el estado en la partición del deportista, las alertas van a users.db en
+    una transacción corta aparte (antes de confirmar el estado): solo se toma el
+    lock compartido cuando hay alerta, y si el estado no llega a guardarse la
+    reevaluación produce la misma dedup_key, que se ignora.
+    """
+    separate = _state_db_path(user_id) != DB_PATH
+
+    def work(conn):
+        row = conn.execute("SELECT state FROM alert_state WHERE user_id=?", (user_id,)).fetchone()
+        state, candidates = evaluate(json.loads(row[0]) if row else None)
+
+        if not candidates:
+            fired = []
+        elif separate:
+            users = sqlite3.connect(DB_PATH, timeout=30)
+            try:
+                fired = _insert_alerts(users, user_id, candidates)
+                users.commit()
+            finally:
+                users.close()
+        else:
+            fired = _insert_alerts(conn, user_id, candidates)
+
+        conn.execute(
+            "INSERT OR REPLACE INTO alert_state (user_id, state) VALUES (?, ?)",
+            (user_id, json.dumps(state))
+        )
+        return fired
+
+    return _state_transaction(user_id, work)
+
+
 # -------------------------------------------------
 # Exportación
 # -------------------------------------------------
-def export_user_data_csv(user_id):
-    q = get_questionnaire_history(user_id)
-    s = get_sensor_history(user_id)
+def export_user_data_csv(user_id, progress=None, path=None):
+    """
+    progress: callback opcional progress(fracción, mensaje) para trabajos en segundo plano
+    path: fichero de salida (por defecto data/export_user_<id>.csv)
+    """
+    progress = progress or (lambda frac, msg: None)
 
-    rows = []
-    for r in q:
-        base = {"type": "questionnaire", "timestamp": r["timestamp"]}
-        base.update(r["responses"])
-        rows.append(base)
+    progress(0.1, "Leyendo cuestionarios")
+    q = get_questionnaire_frame(user_id, parse_dates=False).drop(columns="questionnaire_id")
+    progress(0.3, "Leyendo sensores")
+    s = get_sensor_frame(user_id)
 
-    for r in s:
-        r["type"] = "sensor"
-        rows.append(r)
-
-    df = pd.DataFrame(rows)
-    path = f"data/export_user_{user_id}.csv"
+    progress(0.6, "Preparando CSV")
+    df = pd.concat(
+        [q.assign(type="questionnaire"), s.assign(type="sensor")], ignore_index=True
+    )
+    df = df[["type"] + [c for c in df.columns if c != "type"]]
+    path = path or f"data/export_user_{user_id}.csv"
+    progress(0.8, "Escribiendo fichero")
     df.to_csv(path, index=False)
     return path
+
+
+# -------------------------------------------------
+# Trabajos en segundo plano
+# -------------------------------------------------
+def create_job(job_id, user_id, kind):
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    c = conn.cursor()
+    c.execute(
+        "INSERT INTO jobs (id, user_id, kind, status, message) VALUES (?, ?, ?, 'queued', 'En cola')",
+        (job_id, user_id, kind)
+    )
+    conn.commit()
+    conn.close()
+
+
+def update_job(job_id, **fields):
+    if "result" in fields:
+        fields["result"] = json.dumps(fields["result"])
+    sets = ", ".join(f"{k}=?" for k in fields)
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    c = conn.cursor()
+    c.execute(
+        f"UPDATE jobs SET {sets}, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+        (*fields.values(), job_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+JOB_COLUMNS = "id, user_id, kind, status, progress, message, result, cancel_requested, created_at"
+
+
+def _job_from_row(row):
+    return {
+        "id": row[0],
+        "user_id": row[1],
+        "kind": row[2],
+        "status": row[3],
+        "progress": row[4],
+        "message": row[5],
+        "result": json.loads(row[6]) if row[6] else None,
+        "cancel_requested": bool(row[7]),
+        "created_at": row[8]
+    }
+
+
+def get_job(job_id):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id=?", (job_id,))
+    row = c.fetchone()
+    conn.close()
+    return _job_from_row(row) if row else None
+
+
+def get_user_jobs(user_id, limit=5):
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    c.execute(
+        f"SELECT {JOB_COLUMNS} FROM jobs WHERE user_id=? ORDER BY created_at DESC, rowid DESC LIMIT ?",
+        (user_id, limit)
+    )
+    rows = c.fetchall()
+    conn.close()
+    return [_job_from_row(r) for r in rows]
+
+
+def request_job_cancel(job_id):
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    c = conn.cursor()
+    c.execute(
+        "UPDATE jobs SET cancel_requested=1, updated_at=CURRENT_TIMESTAMP "
+        "WHERE id=? AND status IN ('queued', 'running')",
+        (job_id,)
+    )
+    conn.commit()
+    conn.close()
+
+
+def touch_jobs(job_ids):
+    """
+    Latido de los trabajos en cola o en curso de este proceso (updated_at).
+    """
+    job_ids = list(job_ids)
+    if not job_ids:
+        return
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.execute(
+        f"UPDATE jobs SET updated_at=CURRENT_TIMESTAMP "
+        f"WHERE id IN ({','.join('?' * len(job_ids))}) AND status IN ('queued', 'running')",
+        job_ids
+    )
+    conn.commit()
+    conn.close()
+
+
+def fail_stale_jobs(stale_s):
+    """
+    Trabajos en cola o en curso sin latido en stale_s segundos: su proceso murió
+    (reinicio, despliegue). Se marcan como error para que no queden colgados.
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    c = conn.cursor()
+    c.execute(
+        "UPDATE jobs SET status='error', message='Interrumpido: el servidor se reinició', "
+        "updated_at=CURRENT_TIMESTAMP "
+        "WHERE status IN ('queued', 'running') AND updated_at < datetime('now', ?)",
+        (f"-{int(stale_s)} seconds",)
+    )
+    conn.commit()
+    n = c.rowcount
+    conn.close()
+    return n
+
+
+def claim_job_slot(job_id, max_running, stale_s):
+    """
+    Pasa el trabajo a 'running' si hay hueco: como mucho max_running trabajos
+    en curso entre todos los procesos (los que no tienen latido no cuentan).
+    """
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        running = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status='running' AND updated_at >= datetime('now', ?)",
+            (f"-{int(stale_s)} seconds",)
+        ).fetchone()[0]
+        claimed = False
+        if running < max_running:
+            cur = conn.execute(
+                "UPDATE jobs SET status='running', message='Procesando', updated_at=CURRENT_TIMESTAMP "
+                "WHERE id=? AND status='queued'",
+                (job_id,)
+            )
+            claimed = cur.rowcount > 0
+        conn.execute("COMMIT")
+        return claimed
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
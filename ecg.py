@@ -0,0 +1,215 @@
+# ecg.py
+# Detección de picos R estilo Pan-Tompkins, vectorizada:
+# paso banda → derivada → cuadrado → integración en ventana móvil → umbrales adaptativos
+import numpy as np
+from functools import lru_cache
+from scipy.signal import butter, sosfiltfilt, lfilter, find_peaks
+
+QRS_BAND = (5.0, 15.0)          # Hz, energía del complejo QRS
+WIDE_BAND = (0.5, 40.0)         # Hz, ECG sin línea base ni ruido de alta frecuencia
+FILTER_ORDER = 2
+INTEGRATION_S = 0.150           # ventana de integración (anchura típica del QRS)
+REFRACTORY_S = 0.200            # 200 ms → hasta 300 bpm
+R_SEARCH_S = 0.075              # el pico R se busca ±75 ms alrededor del pico integrado
+
+PEAK_ALPHA = 0.125              # EWMA de alturas de pico (SPKI / NPKI)
+THRESHOLD_RATIO = 0.25          # umbral = NPKI + 0.25 · (SPKI − NPKI)
+SEARCHBACK_RR = 1.66            # hueco > 1.66 · RR mediano → se busca un latido perdido
+
+# Calidad de señal por segmento
+SQI_WINDOW_S = 2                # s; las ráfagas de movimiento duran pocos segundos
+SQI_MIN_KURTOSIS = 5.0          # ECG limpio: muy picudo; ruido gaussiano ≈ 3
+SQI_MIN_PSQI = 0.45             # energía 5-15 Hz / energía 5-40 Hz (ruido blanco ≈ 0.3)
+SQI_MAX_RMS_RATIO = 2.0         # RMS del segmento / mediana de RMS de todos los segmentos
+
+RR_RANGE_S = (0.2, 2.0)
+
+
+@lru_cache(maxsize=32)
+def bandpass_sos(fs, low, high, order=FILTER_ORDER):
+    """
+    Coeficientes SOS del paso banda (se reutilizan entre llamadas con el mismo fs).
+    """
+    high = min(high, 0.45 * fs)
+    return butter(order, [low, high], btype="bandpass", fs=fs, output="sos")
+
+
+def _filter(x, fs, band):
+    sos = bandpass_sos(fs, *band)
+    padlen = 3 * (2 * len(sos) + 1)
+    if len(x) <= padlen:
+        return np.zeros_like(x)
+    return sosfiltfilt(sos, x)
+
+
+def _ewma(values, alpha):
+    if len(values) == 0:
+        return values
+    y, _ = lfilter([alpha], [1, alpha - 1], values, zi=[(1 - alpha) * values[0]])
+    return y
+
+
+def _state_before(mask, values, initial):
+    """
+    Para cada posición, el último valor de `values` (definido donde mask)
+    estrictamente anterior; `initial` si aún no hay ninguno.
+    """
+    full = np.full(len(mask), np.nan)
+    full[mask] = values
+    last = np.maximum.accumulate(np.where(mask, np.arange(len(mask)), -1))
+    before = np.concatenate(([-1], last[:-1]))
+    return np.where(before >= 0, full[np.maximum(before, 0)], initial)
+
+
+# --------------------------------------------------
+# Etapas Pan-Tompkins
+# --------------------------------------------------
+def qrs_energy(ecg, fs):
+    """
+    Devuelve (señal filtrada 5-15 Hz, energía integrada en ventana de 150 ms).
+    """
+    x = np.nan_to_num(np.asarray(ecg, dtype=float))
+    filtered = _filter(x - np.mean(x) if len(x) else x, fs, QRS_BAND)
+    # Derivada de 5 puntos de Pan-Tompkins: (−x[n−2] − 2x[n−1] + 2x[n+1] + x[n+2]) / 8
+    deriv = np.convolve(filtered, np.array([1, 2, 0, -2, -1]) * fs / 8, mode="same")
+    win = max(int(INTEGRATION_S * fs), 1)
+    integrated = np.convolve(deriv ** 2, np.ones(win) / win, mode="same")
+    return filtered, integrated
+
+
+def _adaptive_threshold(heights, n_pass=2):
+    """
+    Clasifica picos candidatos en señal/ruido con SPKI y NPKI como EWMA (lfilter).
+    El umbral de cada candidato usa solo el estado de los anteriores.
+    """
+    is_signal = heights > 0.3 * np.percentile(heights, 95)
+    for _ in range(n_pass):
+        s0 = heights[is_signal][0] if is_signal.any() else heights.max()
+        n0 = heights[~is_signal][0] if (~is_signal).any() else 0.0
+        spki = _state_before(is_signal, _ewma(heights[is_signal], PEAK_ALPHA), s0)
+        npki = _state_before(~is_signal, _ewma(heights[~is_signal], PEAK_ALPHA), n0)
+        threshold = npki + THRESHOLD_RATIO * (spki - npki)
+        is_signal = heights > threshold
+    return is_signal, threshold
+
+
+def detect_r_peaks(ecg, fs=250, quality=None):
+    """
+    Índices de los picos R. Periodo refractario de 200 ms (hasta 300 bpm) y
+    búsqueda hacia atrás con medio umbral en los huecos demasiado largos.
+    quality: resultado de signal_quality; los candidatos de segmentos ruidosos
+    se descartan antes de adaptar los umbrales (no inflan SPKI).
+    """
+    filtered, integrated = qrs_energy(ecg, fs)
+    refractory = max(int(REFRACTORY_S * fs), 1)
+    candidates, props = find_peaks(integrated, distance=refractory, height=0)
+    heights = props["peak_heights"]
+    if quality is not None:
+        good = quality["ok"][np.searchsorted(quality["starts"], candidates, side="right") - 1]
+        candidates, heights = candidates[good], heights[good]
+    if len(candidates) < 2:
+        return np.array([], dtype=int)
+
+    is_r, threshold = _adaptive_threshold(heights)
+
+    # Búsqueda hacia atrás: el mayor candidato por encima de umbral/2 dentro de cada hueco largo
+    r_idx = np.flatnonzero(is_r)
+    if len(r_idx) > 2:
+        rr = np.diff(candidates[r_idx])
+        long_gap = np.flatnonzero(rr > SEARCHBACK_RR * np.median(rr))
+        if len(long_gap):
+            gap_of = np.searchsorted(r_idx, np.arange(len(candidates))) - 1
+            extra = ~is_r & (heights > threshold / 2) & np.isin(gap_of, long_gap)
+            if extra.any():
+                idx = np.flatnonzero(extra)
+                order = np.lexsort((-heights[idx], gap_of[idx]))
+                idx = idx[order]
+                first = np.concatenate(([True], gap_of[idx][1:] != gap_of[idx][:-1]))
+                is_r[idx[first]] = True
+
+    peaks = candidates[is_r]
+
+    # Posición exacta del R: máximo de |señal filtrada| alrededor del pico integrado
+    half = max(int(R_SEARCH_S * fs), 1)
+    window = np.clip(peaks[:, None] + np.arange(-half, half + 1), 0, len(filtered) - 1)
+    peaks = window[np.arange(len(peaks)), np.argmax(np.abs(filtered[window]), axis=1)]
+    peaks = np.unique(peaks)
+    keep = np.concatenate(([True], np.diff(peaks) >= refractory))
+    return peaks[keep]
+
+
+# --------------------------------------------------
+# Calidad de señal
+# --------------------------------------------------
+def signal_quality(ecg, fs=250, window_s=SQI_WINDOW_S):
+    """
+    Calidad por segmentos de `window_s` segundos (el resto se une al último):
+    curtosis de la señal filtrada 0.5-40 Hz y pSQI (espectro de la ventana).
+    Devuelve dict con starts (muestra inicial), kurtosis, psqi y ok.
+    """
+    x = np.nan_to_num(np.asarray(ecg, dtype=float))
+    n = len(x)
+    seg_len = min(max(int(window_s * fs), 1), max(n, 1))
+    n_seg = max(n // seg_len, 1)
+    starts = np.arange(n_seg) * seg_len
+    counts = np.diff(np.append(starts, n))
+
+    wide = _filter(x, fs, WIDE_BAND)
+    mean = np.add.reduceat(wide, starts) / counts
+    c = wide - np.repeat(mean, counts)
+    m2 = np.add.reduceat(c ** 2, starts) / counts
+    m4 = np.add.reduceat(c ** 4, starts) / counts
+
+    # Espectro de las primeras seg_len muestras de cada segmento, todas a la vez
+    frames = x[:n_seg * seg_len].reshape(n_seg, seg_len)
+    power = np.abs(np.fft.rfft(frames - frames.mean(axis=1, keepdims=True), axis=1)) ** 2
+    freqs = np.fft.rfftfreq(seg_len, 1 / fs)
+    p_qrs = power[:, (freqs >= QRS_BAND[0]) & (freqs <= QRS_BAND[1])].sum(axis=1)
+    p_all = power[:, (freqs >= QRS_BAND[0]) & (freqs <= WIDE_BAND[1])].sum(axis=1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        kurt = np.where(m2 > 0, m4 / m2 ** 2, 0.0)
+        psqi = np.where(p_all > 0, p_qrs / p_all, 0.0)
+        # Amplitud frente a la mediana del registro: las ráfagas de movimiento destacan
+        rms = np.sqrt(m2)
+        rms_ratio = rms / np.median(rms)
+    ok = (kurt >= SQI_MIN_KURTOSIS) & (psqi >= SQI_MIN_PSQI) & (rms_ratio <= SQI_MAX_RMS_RATIO)
+    return {"starts": starts, "kurtosis": kurt, "psqi": psqi, "rms_ratio": rms_ratio, "ok": ok}
+
+
+# --------------------------------------------------
+# FC y HRV
+# --------------------------------------------------
+def compute_bpm_hrv(ecg, fs=250, check_quality=True):
+    """
+    Devuelve (bpm, hrv RMSSD en ms, picos R). Con check_quality se descartan
+    los segmentos ruidosos y los RR que los atraviesan.
+    None si no quedan al menos dos RR válidos.
+    """
+    ecg = np.asarray(ecg, dtype=float)
+    if len(ecg) < fs:
+        # Menos de 1 s: no caben dos RR
+        return None, None, np.array([], dtype=int)
+
+    quality = signal_quality(ecg, fs) if check_quality else None
+    peaks = detect_r_peaks(ecg, fs, quality)
+    if len(peaks) < 2:
+        return None, None, peaks
+
+    rr = np.diff(peaks) / fs
+    valid = (rr >= RR_RANGE_S[0]) & (rr <= RR_RANGE_S[1])
+    if quality is not None:
+        # Un RR que salta un segmento descartado no es un intervalo real
+        seg = np.searchsorted(quality["starts"], peaks, side="right") - 1
+        valid &= np.diff(seg) <= 1
+
+    rr_ok = rr[valid]
+    if len(rr_ok) < 2:
+        return None, None, peaks
+
+    bpm = 60 / np.mean(rr_ok)
+    # Diferencias sucesivas solo entre RR contiguos y válidos
+    pair = valid[:-1] & valid[1:]
+    diff_rr = np.diff(rr)[pair]
+    hrv = np.sqrt(np.mean(diff_rr ** 2)) * 1000 if len(diff_rr) else None
+    return float(bpm), (float(hrv) if hrv is not None else None), peaks
@@ -0,0 +1,136 @@
+# hr_load.py
+import numpy as np
+import pandas as pd
+from db import get_user_age, update_daily_hr_load, replace_daily_hr_load, get_sensor_frame
+
+HR_REST = 60
+DEFAULT_AGE = 25
+MAX_GAP_S = 10          # huecos más largos no suman tiempo (sensor desconectado)
+
+# Zonas de Edwards: % de FCmáx → peso 1..5
+ZONE_EDGES = np.array([0.5, 0.6, 0.7, 0.8, 0.9])
+ZONE_COLUMNS = ["z1_s", "z2_s", "z3_s", "z4_s", "z5_s"]
+
+# Banister: TRIMP = min · HRr · 0.64 · e^(1.92 · HRr)
+BANISTER_A = 0.64
+BANISTER_B = 1.92
+
+LOAD_COLUMNS = ZONE_COLUMNS + ["trimp_banister", "trimp_edwards"]
+
+
+def hr_limits(user_id):
+    age = get_user_age(user_id) or DEFAULT_AGE
+    return 220 - age, HR_REST
+
+
+# --------------------------------------------------
+# Cálculo vectorizado
+# --------------------------------------------------
+def compute_hr_load(ts, bpm, hr_max, hr_rest=HR_REST, max_gap_s=MAX_GAP_S):
+    """
+    ts: epoch en segundos (ordenado), bpm: array
+    Cada muestra aporta el tiempo hasta la siguiente (si el hueco es <= max_gap_s).
+    Devuelve un DataFrame por día (UTC) con segundos por zona y TRIMP Banister/Edwards.
+    """
+    ts = np.asarray(ts, dtype=float)
+    bpm = np.asarray(bpm, dtype=float)
+    if len(ts) < 2:
+        return pd.DataFrame(columns=["day"] + LOAD_COLUMNS)
+
+    dt = np.diff(ts)
+    dt = np.where((dt > 0) & (dt <= max_gap_s), dt, 0.0)
+    hr = bpm[:-1]
+    valid = ~np.isnan(hr) & (dt > 0)
+    dt, hr, t = dt[valid], hr[valid], ts[:-1][valid]
+    if len(dt) == 0:
+        return pd.DataFrame(columns=["day"] + LOAD_COLUMNS)
+
+    zone = np.searchsorted(ZONE_EDGES, hr / hr_max, side="right")  # 0 = por debajo de Z1
+    hrr = np.clip((hr - hr_rest) / (hr_max - hr_rest), 0.0, 1.0)
+    banister = dt / 60 * hrr * BANISTER_A * np.exp(BANISTER_B * hrr)
+    edwards = dt / 60 * zone
+
+    days, day_idx = np.unique((t // 86400).astype(np.int64), return_inverse=True)
+    n = len(days)
+    out = {"day": pd.to_datetime(days, unit="D").strftime("%Y-%m-%d")}
+    for z, col in enumerate(ZONE_COLUMNS, start=1):
+        out[col] = np.bincount(day_idx, weights=np.where(zone == z, dt, 0.0), minlength=n)
+    out["trimp_banister"] = np.bincount(day_idx, weights=banister, minlength=n)
+    out["trimp_edwards"] = np.bincount(day_idx, weights=edwards, minlength=n)
+    return pd.DataFrame(out)
+
+
+# --------------------------------------------------
+# Incremental (en la ingesta)
+# --------------------------------------------------
+def _valid_samples(ts, bpm):
+    """
+    Muestras con BPM, en orden temporal. Igual en la ingesta y en el recálculo:
+    una lectura sin BPM no corta el intervalo entre dos muestras válidas.
+    """
+    ts = np.asarray(ts, dtype=float)
+    bpm = np.asarray(bpm, dtype=float)
+    valid = ~np.isnan(bpm)
+    ts, bpm = ts[valid], bpm[valid]
+    order = np.argsort(ts, kind="stable")
+    return ts[order], bpm[order]
+
+
+def _load_after(last, ts, bpm, hr_max, hr_rest):
+    """
+    Carga de las muestras posteriores a la última contada (last = (ts, bpm) o None).
+    Devuelve (daily, nuevo último) o (None, None) si no hay nada nuevo.
+    """
+    if last is not None:
+        new = ts > last[0]
+        if not new.any():
+            return None, None
+        ts = np.concatenate(([last[0]], ts[new]))
+        bpm = np.concatenate(([last[1]], bpm[new]))
+    elif len(ts) == 0:
+        return None, None
+    return compute_hr_load(ts, bpm, hr_max, hr_rest), (float(ts[-1]), float(bpm[-1]))
+
+
+def update_hr_load(user_id, ts, bpm):
+    """
+    Suma la carga de las muestras nuevas a los totales diarios.
+    Solo se guarda la última muestra contada por deportista (estado O(1));
+    lo anterior a ella ya está en los totales y se ignora.
+    """
+    if bpm is None or len(ts) == 0:
+        return
+    ts, bpm = _valid_samples(ts, bpm)
+    if len(ts) == 0:
+        return
+    hr_max, hr_rest = hr_limits(user_id)
+
+    update_daily_hr_load(user_id, lambda last: _load_after(last, ts, bpm, hr_max, hr_rest))
+
+
+# --------------------------------------------------
+# Recalcular todo el histórico
+# --------------------------------------------------
+def _sensor_bpm(user_id, since=None):
+    # ts en µs sin convertir a fechas; `since` (s) deja fuera lo ya contado
+    start = None if since is None else int(round(since * 1e6)) + 1
+    df = get_sensor_frame(user_id, parse_dates=False, start=start)
+    return _valid_samples(df["timestamp"].to_numpy() / 1e6, df["bpm"].to_numpy())
+
+
+def rebuild_hr_load(user_id):
+    """
+    Recalcula el histórico sin bloquear la ingesta: todo lo guardado hasta la
+    última muestra (marca de agua) se calcula fuera del lock; con el lock
+    tomado solo se suma lo que llegó mientras tanto.
+    """
+    hr_max, hr_rest = hr_limits(user_id)
+    ts, bpm = _sensor_bpm(user_id)
+    daily = compute_hr_load(ts, bpm, hr_max, hr_rest)
+    last = (float(ts[-1]), float(bpm[-1])) if len(ts) else None
+
+    def evaluate(last):
+        t, b = _sensor_bpm(user_id, None if last is None else last[0])
+        return _load_after(last, t, b, hr_max, hr_rest)
+
+    return replace_daily_hr_load(user_id, daily, last, evaluate)
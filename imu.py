@@ -0,0 +1,263 @@
+# imu.py
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from numpy.lib.stride_tricks import sliding_window_view
+
+G = 9.81  # m/s²
+
+ACCEL_COLS = ["accel_x", "accel_y", "accel_z"]
+GYRO_COLS = ["gyro_x", "gyro_y", "gyro_z"]
+
+# Umbrales de baile (en m/s² y segundos)
+ACTIVITY_THRESHOLD = 0.1 * G     # desviación de 1 g que cuenta como actividad
+FREEFALL_THRESHOLD = 0.35 * G    # fase de vuelo de un salto
+LANDING_THRESHOLD = 2.0 * G      # impacto de aterrizaje
+MIN_FLIGHT_S = 0.08
+LANDING_SEARCH_S = 0.15
+
+_CACHE_SIZE = 32
+FINGERPRINT_ROWS = 64
+_feature_cache = OrderedDict()
+
+
+# --------------------------------------------------
+# Utilidades vectorizadas
+# --------------------------------------------------
+def _windows(x, win, step):
+    """
+    Vista (sin copia) de x en ventanas de `win` muestras cada `step`.
+    """
+    return sliding_window_view(x, win, axis=0)[::step]
+
+
+def _window_sums(x, win, step):
+    """
+    Suma por ventana usando sumas acumuladas (O(n), sin ventanas materializadas).
+    """
+    cs = np.concatenate(([0.0], np.cumsum(x, dtype=float)))
+    starts = np.arange(0, len(x) - win + 1, step)
+    return cs[starts + win] - cs[starts]
+
+
+def _as_array(df, cols):
+    if not set(cols).issubset(df.columns):
+        return None
+    return df[cols].to_numpy(dtype=float)
+
+
+# --------------------------------------------------
+# Saltos / aterrizajes
+# --------------------------------------------------
+def detect_jumps(magnitude, fs):
+    """
+    Detecta saltos como una fase de caída libre seguida de un impacto.
+    Devuelve (índices de aterrizaje, tiempo de vuelo en s, pico de impacto).
+    """
+    mag = np.asarray(magnitude, dtype=float)
+    n = len(mag)
+    empty = np.array([], dtype=int), np.array([]), np.array([])
+    if n < 2:
+        return empty
+
+    freefall = np.concatenate(([False], mag < FREEFALL_THRESHOLD, [False]))
+    edges = np.diff(freefall.astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    flight = (ends - starts) / fs
+    keep = flight >= MIN_FLIGHT_S
+    starts, ends, flight = starts[keep], ends[keep], flight[keep]
+    if len(ends) == 0:
+        return empty
+
+    # Pico máximo tras la fase de vuelo (vista de ventanas sobre la señal)
+    search = max(int(round(LANDING_SEARCH_S * fs)), 1)
+    padded = np.concatenate((mag, np.zeros(search)))
+    ends = np.minimum(ends, n - 1)
+    after = _windows(padded, search, 1)[ends]
+    offset = after.argmax(axis=1)
+    impact = after[np.arange(len(ends)), offset]
+    landed = impact >= LANDING_THRESHOLD
+
+    landing_idx = ends[landed] + offset[landed]
+    return landing_idx, flight[landed], impact[landed]
+
+
+# --------------------------------------------------
+# Motor de features por ventanas
+# --------------------------------------------------
+def compute_imu_features(df, fs=100, window_s=2.0, step_s=1.0):
+    """
+    Features IMU por ventana deslizante.
+    Espera columnas accel_x/y/z (m/s²) y opcionalmente gyro_x/y/z (rad/s).
+
+    Devuelve un DataFrame con una fila por ventana:
+    - t_start (s desde el inicio)
+    - accel_mean: magnitud media de aceleración
+    - jerk: media del |d|a|/dt|
+    - activity_counts: muestras con |a| alejada de 1 g más de ACTIVITY_THRESHOLD
+    - jumps / impact_peak: saltos detectados y mayor impacto de aterrizaje
+    - gyro_energy: energía media de la velocidad angular
+    - dominant_freq: frecuencia dominante del movimiento (Hz)
+    """
+    accel = _as_array(df, ACCEL_COLS)
+    if accel is None:
+        return None
+
+    win = max(int(round(window_s * fs)), 2)
+    step = max(int(round(step_s * fs)), 1)
+    n = len(accel)
+    if n < win:
+        return pd.DataFrame()
+
+    starts = np.arange(0, n - win + 1, step)
+
+    mag = np.sqrt(np.einsum("ij,ij->i", accel, accel))
+    jerk = np.abs(np.diff(mag, prepend=mag[0])) * fs
+    active = (np.abs(mag - G) > ACTIVITY_THRESHOLD).astype(float)
+
+    features = {
+        "t_start": starts / fs,
+        "accel_mean": _window_sums(mag, win, step) / win,
+        "jerk": _window_sums(jerk, win, step) / win,
+        "activity_counts": _window_sums(active, win, step),
+    }
+
+    # Saltos asignados a su ventana por índice de aterrizaje
+    landing_idx, _, impact = detect_jumps(mag, fs)
+    lo = np.searchsorted(landing_idx, starts, side="left")
+    hi = np.searchsorted(landing_idx, starts + win, side="left")
+    features["jumps"] = hi - lo
+    impact_peak = np.zeros(len(starts))
+    has = hi > lo
+    if has.any():
+        # máximo por segmento [lo, hi): reduceat sobre índices intercalados
+        bounds = np.column_stack((lo[has], hi[has])).ravel()
+        impact_peak[has] = np.maximum.reduceat(np.append(impact, 0.0), bounds)[::2]
+    features["impact_peak"] = impact_peak
+
+    # Frecuencia dominante con el giroscopio donde la ventana lo tiene completo;
+    # si no (filas antiguas, CSV sin giroscopio), con la magnitud de aceleración
+    gyro = _as_array(df, GYRO_COLS)
+    gyro_energy = np.full(len(starts), np.nan)
+    gyro_ok = np.zeros(len(starts), dtype=bool)
+    if gyro is not None:
+        gyro_sq = np.einsum("ij,ij->i", gyro, gyro)
+        missing = np.isnan(gyro_sq)
+        gyro_ok = _window_sums(missing, win, step) == 0
+        # Sin NaN en la suma acumulada: un hueco no contamina las ventanas siguientes
+        sums = _window_sums(np.where(missing, 0.0, gyro_sq), win, step)
+        gyro_energy[gyro_ok] = sums[gyro_ok] / win
+    features["gyro_energy"] = gyro_energy
+
+    dominant = np.empty(len(starts))
+    if gyro_ok.any():
+        dominant[gyro_ok] = _dominant_freq(_windows(np.sqrt(gyro_sq), win, step)[gyro_ok], fs)
+    if not gyro_ok.all():
+        dominant[~gyro_ok] = _dominant_freq(_windows(mag, win, step)[~gyro_ok], fs)
+    features["dominant_freq"] = dominant
+
+    return pd.DataFrame(features)
+
+
+def _dominant_freq(frames, fs):
+    """
+    Frecuencia dominante (sin DC) de cada ventana con FFT.
+    """
+    spectrum = np.abs(np.fft.rfft(frames - frames.mean(axis=1, keepdims=True), axis=1))
+    freqs = np.fft.rfftfreq(frames.shape[1], d=1.0 / fs)
+    return freqs[1:][spectrum[:, 1:].argmax(axis=1)]
+
+
+def compute_dance_workload(df, fs=100, window_s=2.0, step_s=1.0, session_key=None):
+    """
+    Resumen de carga de una sesión de baile a partir de las features IMU.
+    Con session_key el resumen completo (magnitud y saltos incluidos) queda en caché.
+    """
+    key = _cache_key(session_key, df, (fs, window_s, step_s))
+    return _cached("workload", key, lambda: _dance_workload(df, fs, window_s, step_s, key))
+
+
+def _dance_workload(df, fs, window_s, step_s, key):
+    accel = _as_array(df, ACCEL_COLS)
+    if accel is None or len(accel) < 2:
+        return None
+
+    mag = np.sqrt(np.einsum("ij,ij->i", accel, accel))
+    duration_min = len(mag) / fs / 60
+    _, flight, impact = detect_jumps(mag, fs)
+
+    # Misma clave que get_session_features: la huella se calcula una sola vez
+    features = _cached("features", key, lambda: compute_imu_features(df, fs, window_s, step_s))
+    if features is None or features.empty:
+        return None
+
+    # Player-load: suma de la variación de aceleración entre muestras
+    player_load = float(np.sum(np.sqrt(np.sum(np.diff(accel, axis=0) ** 2, axis=1)))) / 100
+
+    return {
+        "duration_min": duration_min,
+        "player_load": player_load,
+        "jumps": int(len(flight)),
+        "jumps_per_min": len(flight) / duration_min if duration_min else 0.0,
+        "mean_flight_s": float(flight.mean()) if len(flight) else 0.0,
+        "max_impact_g": float(impact.max() / G) if len(impact) else 0.0,
+        "active_pct": float(np.mean(np.abs(mag - G) > ACTIVITY_THRESHOLD) * 100),
+        "mean_jerk": float(features["jerk"].mean()),
+        "gyro_energy": float(features["gyro_energy"].mean()),
+        "dominant_freq": float(features["dominant_freq"].median()),
+    }
+
+
+# --------------------------------------------------
+# Caché por sesión
+# --------------------------------------------------
+def _frame_fingerprint(df):
+    """
+    Versión barata del contenido: nº de filas más una muestra fija de filas
+    (primera, última y FINGERPRINT_ROWS repartidas). Coste independiente de la
+    duración de la sesión; otro registro con la misma longitud no la comparte.
+    """
+    n = len(df)
+    cols = [c for c in ["timestamp"] + ACCEL_COLS + GYRO_COLS if c in df.columns]
+    if n == 0 or not cols:
+        return (n,)
+    rows = np.unique(np.linspace(0, n - 1, FINGERPRINT_ROWS).astype(int))
+    sample = df.iloc[rows][cols].to_numpy()
+    return (n, hash(sample.tobytes()) if sample.dtype != object else hash(str(sample.tolist())))
+
+
+def _cache_key(session_key, df, params):
+    if session_key is None:
+        return None
+    return (session_key, _frame_fingerprint(df)) + tuple(params)
+
+
+def _cached(kind, key, compute):
+    if key is None:
+        return compute()
+
+    key = (kind,) + key
+    if key in _feature_cache:
+        _feature_cache.move_to_end(key)
+        return _feature_cache[key]
+
+    value = compute()
+    _feature_cache[key] = value
+    if len(_feature_cache) > _CACHE_SIZE:
+        _feature_cache.popitem(last=False)
+    return value
+
+
+def get_session_features(session_key, df, fs=100, window_s=2.0, step_s=1.0):
+    """
+    Igual que compute_imu_features pero memoizado por sesión.
+    La clave incluye una huella barata del contenido (ver _frame_fingerprint).
+    """
+    key = _cache_key(session_key, df, (fs, window_s, step_s))
+    return _cached("features", key, lambda: compute_imu_features(df, fs, window_s, step_s))
+
+
+def clear_feature_cache():
+    _feature_cache.clear()
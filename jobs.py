@@ -0,0 +1,194 @@
+# jobs.py
+import os
+import time
+import uuid
+import threading
+import traceback
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from db import (
+    create_job, update_job, get_job, request_job_cancel, touch_jobs, fail_stale_jobs, claim_job_slot,
+    export_user_data_csv, save_sensor_data_bulk, JOB_HEARTBEAT_S, JOB_STALE_S
+)
+from sensors import parse_csv_contents, load_ecg_and_compute_bpm
+from hr_load import rebuild_hr_load
+
+# Máximo de trabajos ejecutándose a la vez entre todos los procesos (tabla jobs);
+# el resto queda en cola
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", 2))
+SLOT_POLL_S = 1.0
+IMPORT_CHUNK_ROWS = 5000
+ECG_WINDOW_S = 10
+
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="job")
+
+# Trabajos en cola o en curso en este proceso (los que reciben latido)
+_active = set()
+_active_lock = threading.Lock()
+_heartbeat = None
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """
+    Se pasa a cada tarea para informar del progreso y comprobar la cancelación.
+    El estado vive en la tabla jobs, así que cualquier worker puede consultarlo.
+    """
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def progress(self, fraction, message=None):
+        job = get_job(self.job_id)
+        if job and job["cancel_requested"]:
+            raise JobCancelled()
+        fields = {"progress": float(min(max(fraction, 0.0), 1.0))}
+        if message:
+            fields["message"] = message
+        update_job(self.job_id, **fields)
+
+
+def _heartbeat_loop():
+    """
+    Mantiene vivos (updated_at) los trabajos de este proceso y marca como error
+    los de procesos que murieron: sus hilos no volverán a actualizarlos.
+    """
+    while True:
+        time.sleep(JOB_HEARTBEAT_S)
+        try:
+            with _active_lock:
+                ids = list(_active)
+            touch_jobs(ids)
+            fail_stale_jobs(JOB_STALE_S)
+        except Exception:
+            traceback.print_exc()
+
+
+def _ensure_heartbeat():
+    global _heartbeat
+    with _active_lock:
+        if _heartbeat is None:
+            _heartbeat = threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True)
+            _heartbeat.start()
+
+
+def _run(job_id, fn, args):
+    try:
+        # En cola hasta que haya hueco en el límite global (otros workers incluidos)
+        while True:
+            job = get_job(job_id)
+            if job is None or job["status"] != "queued":
+                return
+            if job["cancel_requested"]:
+                update_job(job_id, status="cancelled", message="Cancelado")
+                return
+            if claim_job_slot(job_id, MAX_CONCURRENT_JOBS, JOB_STALE_S):
+                break
+            time.sleep(SLOT_POLL_S)
+        try:
+            result = fn(JobContext(job_id), *args)
+            update_job(job_id, status="done", progress=1.0, message="Completado", result=result)
+        except JobCancelled:
+            update_job(job_id, status="cancelled", message="Cancelado")
+        except Exception as e:
+            traceback.print_exc()
+            update_job(job_id, status="error", message=str(e))
+    finally:
+        with _active_lock:
+            _active.discard(job_id)
+
+
+def submit_job(kind, user_id, fn, *args):
+    job_id = uuid.uuid4().hex
+    create_job(job_id, user_id, kind)
+    with _active_lock:
+        _active.add(job_id)
+    _ensure_heartbeat()
+    _executor.submit(_run, job_id, fn, args)
+    return job_id
+
+
+def cancel_job(job_id):
+    request_job_cancel(job_id)
+
+
+# --------------------------------------------------
+# Tareas
+# --------------------------------------------------
+def export_task(ctx, user_id):
+    # Un fichero por trabajo: una exportación posterior no pisa la ya descargable
+    path = export_user_data_csv(user_id, progress=ctx.progress,
+                                path=f"data/export_user_{user_id}_{ctx.job_id}.csv")
+    return {"path": path}
+
+
+def import_task(ctx, user_id, contents, filename):
+    """
+    CSV con timestamp, bpm, hrv, accel_x/y/z (y opcionalmente gyro_x/y/z).
+    Si trae columna ECG se recalculan BPM/HRV desde la señal.
+    """
+    ctx.progress(0.05, "Leyendo CSV")
+    df = parse_csv_contents(contents, filename)
+    if df is None or df.empty:
+        raise ValueError("Archivo vacío o inválido")
+
+    if "ECG" in df.columns:
+        return ecg_reprocess_task(ctx, user_id, df)
+
+    required = {"timestamp", "bpm", "hrv", "accel_x", "accel_y", "accel_z"}
+    if not required.issubset(df.columns):
+        raise ValueError("El CSV no tiene las columnas necesarias")
+
+    # Fechas tal cual: save_sensor_data_bulk las pasa a µs (naive = UTC) sin depender
+    # de la unidad interna de datetime64 (en pandas 3, µs y no ns)
+    ts = pd.to_datetime(df["timestamp"]).to_numpy()
+    names = [c for c in ("bpm", "hrv", "spo2", "accel_x", "accel_y", "accel_z",
+                         "gyro_x", "gyro_y", "gyro_z") if c in df.columns]
+    values = {c: df[c].astype(float).to_numpy() for c in names}
+
+    total = len(df)
+    for start in range(0, total, IMPORT_CHUNK_ROWS):
+        stop = min(start + IMPORT_CHUNK_ROWS, total)
+        save_sensor_data_bulk(user_id, "CSV", ts[start:stop],
+                              {c: v[start:stop] for c, v in values.items()})
+        ctx.progress(0.1 + 0.85 * stop / total, f"{stop}/{total} registros importados")
+
+    ctx.progress(0.95, "Recalculando carga de FC")
+    rebuild_hr_load(user_id)
+    return {"rows": total}
+
+
+def ecg_reprocess_task(ctx, user_id, df, fs=None):
+    """
+    Recalcula BPM y HRV por ventanas de ECG_WINDOW_S segundos y los guarda como muestras.
+    """
+    if fs is None:
+        fs = 250
+        if "Time" in df.columns and len(df) > 1:
+            fs = round(1 / np.median(np.diff(df["Time"].astype(float).to_numpy())))
+
+    ecg = df["ECG"].astype(float).to_numpy()
+    win = int(ECG_WINDOW_S * fs)
+    starts = list(range(0, max(len(ecg) - win, 0) + 1, win)) or [0]
+    t0 = time.time() - len(ecg) / fs
+
+    ts, bpm, hrv = [], [], []
+    for i, start in enumerate(starts):
+        b, h, _ = load_ecg_and_compute_bpm(pd.DataFrame({"ECG": ecg[start:start + win]}), fs=fs)
+        if b is not None:
+            ts.append(t0 + start / fs)
+            bpm.append(b)
+            hrv.append(h)
+        ctx.progress(0.1 + 0.8 * (i + 1) / len(starts), f"Ventana ECG {i + 1}/{len(starts)}")
+
+    save_sensor_data_bulk(user_id, "ECG", np.array(ts), {"bpm": np.array(bpm), "hrv": np.array(hrv)})
+    rebuild_hr_load(user_id)
+    return {
+        "rows": len(ts),
+        "bpm": float(np.mean(bpm)) if bpm else None,
+        "hrv": float(np.mean(hrv)) if hrv else None,
+    }
@@ -0,0 +1,248 @@
+# opensignals.py
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+try:
+    import h5py
+except ImportError:  # solo necesario para grabaciones .h5
+    h5py = None
+
+TEXT_MAGIC = b"# OpenSignals"
+END_OF_HEADER = b"# EndOfHeader"
+COUNT_BLOCK = 64 * 1024 * 1024
+# Caché .npy de las grabaciones de texto (fuera de la carpeta de origen, que puede ser de solo lectura)
+CACHE_DIR = os.environ.get("OPENSIGNALS_CACHE_DIR", os.path.join("data", "opensignals_cache"))
+
+# Funciones de transferencia BITalino (datasheets)
+VCC = 3.3
+ECG_GAIN = 1100
+ACC_CMIN_10BIT = 208
+ACC_CMAX_10BIT = 312
+G = 9.81
+
+
+# --------------------------------------------------
+# Conversión ADC → unidades físicas
+# --------------------------------------------------
+def ecg_to_mv(raw, resolution=10):
+    return (np.asarray(raw, dtype=float) / 2 ** resolution - 0.5) * VCC / ECG_GAIN * 1000
+
+
+def acc_to_ms2(raw, resolution=10, cmin=None, cmax=None):
+    scale = 2 ** (resolution - 10)
+    cmin = ACC_CMIN_10BIT * scale if cmin is None else cmin
+    cmax = ACC_CMAX_10BIT * scale if cmax is None else cmax
+    return ((np.asarray(raw, dtype=float) - cmin) / (cmax - cmin) * 2 - 1) * G
+
+
+def _start_time(meta):
+    """
+    Inicio de la grabación según la cabecera ("date" + "time"), tal como lo
+    escribe OpenSignals (sin zona horaria). None si falta o no se entiende.
+    """
+    date, time = meta.get("date"), meta.get("time")
+    if not date or not time:
+        return None
+    try:
+        return pd.Timestamp(f"{date} {time}")
+    except ValueError:
+        return None
+
+
+# --------------------------------------------------
+# Grabación OpenSignals
+# --------------------------------------------------
+class OpenSignalsRecording:
+    """
+    Grabación de un dispositivo OpenSignals (.txt o .h5).
+    Los canales se exponen como vistas sobre un array mapeado en memoria,
+    así que una grabación de horas no se carga entera en RAM.
+    """
+
+    def __init__(self, path, device=None, cache_dir=None):
+        self.path = path
+        self.cache_dir = cache_dir or CACHE_DIR
+        if path.endswith((".h5", ".hdf5")):
+            self._open_h5(device)
+        else:
+            self._open_text(device)
+
+    # ---------------- texto ----------------
+    def _open_text(self, device):
+        with open(self.path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if mm[:len(TEXT_MAGIC)] != TEXT_MAGIC:
+                    raise ValueError("No es un fichero de texto OpenSignals")
+                end = mm.find(END_OF_HEADER)
+                if end < 0:
+                    raise ValueError("Cabecera OpenSignals incompleta")
+                data_start = mm.find(b"\n", end) + 1
+                header_lines = mm[:data_start].decode("utf-8").splitlines()
+                # Contar filas por bloques para no copiar el fichero entero
+                n_rows = sum(
+                    mm[i:i + COUNT_BLOCK].count(b"\n") for i in range(data_start, len(mm), COUNT_BLOCK)
+                )
+                if len(mm) > data_start and mm[-1:] != b"\n":
+                    n_rows += 1
+            finally:
+                mm.close()
+
+        header = json.loads(header_lines[1].lstrip("# ").strip())
+        self._set_header(header, device)
+        self._header_lines = len(header_lines)
+        self.n_rows = n_rows
+        self.data = self._text_cache(n_rows)
+
+    def _cache_path(self):
+        """
+        .npy en cache_dir; el nombre depende de ruta, tamaño y fecha del fichero,
+        así que un fichero modificado usa otra caché y nunca se reemplaza una en uso.
+        """
+        st = os.stat(self.path)
+        key = f"{os.path.abspath(self.path)}|{st.st_size}|{st.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        return os.path.join(self.cache_dir, f"{name}-{digest}.npy")
+
+    def _text_cache(self, n_rows):
+        """
+        Convierte el texto una sola vez (por bloques) a un .npy y lo abre con mmap.
+        Se escribe en un temporal único: dos aperturas simultáneas no chocan.
+        """
+        cache = self._cache_path()
+        if not os.path.exists(cache):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".npy.tmp", dir=self.cache_dir)
+            os.close(fd)
+            try:
+                out = np.lib.format.open_memmap(
+                    tmp, mode="w+", dtype=np.float32, shape=(n_rows, len(self.columns))
+                )
+                row = 0
+                reader = pd.read_csv(
+                    self.path, sep="\t", header=None, skiprows=self._header_lines,
+                    usecols=range(len(self.columns)), dtype=np.float32, chunksize=200000
+                )
+                for chunk in reader:
+                    out[row:row + len(chunk)] = chunk.to_numpy()
+                    row += len(chunk)
+                out.flush()
+                del out
+                try:
+                    os.replace(tmp, cache)
+                except PermissionError:
+                    # Windows: otra apertura ya creó la caché y la tiene mapeada
+                    if not os.path.exists(cache):
+                        raise
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        return np.load(cache, mmap_mode="r")
+
+    # ---------------- HDF5 ----------------
+    def _open_h5(self, device):
+        if h5py is None:
+            raise ImportError("Para leer grabaciones .h5 hace falta instalar h5py")
+        self._h5 = h5py.File(self.path, "r")
+        mac = device or next(iter(self._h5.keys()))
+        group = self._h5[mac]
+        attrs = {k: (v.tolist() if hasattr(v, "tolist") else v) for k, v in group.attrs.items()}
+        attrs = {k: (v.decode() if isinstance(v, bytes) else v) for k, v in attrs.items()}
+
+        raw = group["raw"]
+        analog = sorted((k for k in raw.keys() if k.startswith("channel_")),
+                        key=lambda k: int(k.split("_")[1]))
+        resolution = np.atleast_1d(attrs.get("resolution", 10)).tolist()
+        if len(resolution) == 1:
+            resolution = resolution * len(analog)
+        header = {mac: {
+            "sampling rate": attrs.get("sampling rate"),
+            "column": ["nSeq"] + analog,
+            "label": attrs.get("label") or [f"A{k.split('_')[1]}" for k in analog],
+            "sensor": attrs.get("sensor") or ["RAW"] * len(analog),
+            "resolution": [4] + resolution[-len(analog):],
+            # Inicio de la grabación, como en la cabecera de los .txt
+            "date": attrs.get("date"),
+            "time": attrs.get("time"),
+        }}
+        self._set_header(header, mac)
+        self._datasets = [raw["nSeq"]] + [raw[k] for k in analog]
+        self.n_rows = len(raw["nSeq"])
+        self.data = None
+
+    # ---------------- común ----------------
+    def _set_header(self, header, device):
+        self.device = device or next(iter(header))
+        meta = header[self.device]
+        self.header = meta
+        self.start_time = _start_time(meta)
+        self.fs = float(meta["sampling rate"])
+        self.columns = list(meta["column"])
+        self.labels = list(meta.get("label", []))
+        self.sensors = list(meta.get("sensor", []))
+        resolution = list(meta.get("resolution", []))
+        # Los canales analógicos son las últimas columnas, en el orden de `label`
+        first_analog = len(self.columns) - len(self.labels)
+        self._analog = {label: first_analog + i for i, label in enumerate(self.labels)}
+        self._resolution = {
+            label: int(resolution[first_analog + i]) if len(resolution) > first_analog + i else 10
+            for i, label in enumerate(self.labels)
+        }
+
+    def __len__(self):
+        # Se guarda al abrir: sigue siendo válido después de close()
+        return self.n_rows
+
+    @property
+    def duration_s(self):
+        return len(self) / self.fs
+
+    def _column(self, name):
+        if name in self._analog:
+            return name
+        if name in self.sensors:
+            return self.labels[self.sensors.index(name)]
+        raise KeyError(f"Canal desconocido: {name}")
+
+    def channel(self, name, start=0, stop=None):
+        """
+        Valores ADC de un canal (por etiqueta "A2" o sensor "ECG").
+        En .txt devuelve una vista sobre el mmap; en .h5 lee solo el tramo pedido.
+        """
+        label = self._column(name)
+        col = self._analog[label]
+        if self.data is not None:
+            return self.data[start:stop, col]
+        return self._datasets[col][start:stop].reshape(-1)
+
+    def resolution(self, name):
+        return self._resolution[self._column(name)]
+
+    def iter_chunks(self, names, chunk_s=60.0, overlap_s=0.0):
+        """
+        Recorre la grabación por bloques de `chunk_s` segundos.
+        Devuelve (t_inicio, {nombre: array}) por bloque.
+        """
+        n = len(self)
+        size = max(int(chunk_s * self.fs), 1)
+        overlap = int(overlap_s * self.fs)
+        for start in range(0, n, size):
+            lo = max(start - overlap, 0)
+            stop = min(start + size, n)
+            yield lo / self.fs, {name: self.channel(name, lo, stop) for name in names}
+
+    def close(self):
+        if getattr(self, "_h5", None) is not None:
+            self._h5.close()
+            self._h5 = None
+        self.data = None
+
+
+def read_opensignals(path, device=None, cache_dir=None):
+    return OpenSignalsRecording(path, device, cache_dir)
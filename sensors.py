@@ -1,5 +1,13 @@
 import base64
+import gzip
 import io
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import uuid
 import pandas as pd
 import numpy as np
 from scipy.signal import find_peaks
@@ -8,6 +16,9 @@ import math
 import time
 import requests
 from db import get_athletes_by_sport, save_sensor_data
+from imu import get_session_features, compute_dance_workload
+from opensignals import read_opensignals, ecg_to_mv, acc_to_ms2
+from ecg import compute_bpm_hrv
 
 API_URL = "http://127.0.0.1:8050/api/send_sensor_data"
 
@@ -35,12 +46,14 @@ def parse_csv_contents(contents, filename):
 # ECG → BPM + HRV
 # Espera columnas: Time, ECG
 # --------------------------------------------------
-def load_ecg_and_compute_bpm(df, fs=250):
+def load_ecg_and_compute_bpm(df, fs=250, legacy=False):
     """
     Devuelve:
     - bpm
     - hrv (RMSSD)
     - señal ECG (numpy array)
+    Por defecto usa el detector filtrado (ecg.py), que descarta segmentos ruidosos.
+    legacy=True: find_peaks sobre la señal cruda (FC máx. 150 bpm).
     """
     try:
         if "ECG" not in df.columns:
@@ -48,6 +61,10 @@ def load_ecg_and_compute_bpm(df, fs=250):
 
         ecg = df["ECG"].astype(float).values
 
+        if not legacy:
+            bpm, hrv, _ = compute_bpm_hrv(ecg, fs)
+            return bpm, hrv, ecg
+
         # Detectar picos R
         peaks, _ = find_peaks(ecg, distance=fs*0.4, prominence=0.3)
 
@@ -91,10 +108,312 @@ def process_imu(df):
     return magnitude    
 
 
+# --------------------------------------------------
+# IMU → features por ventana + carga de baile
+# Columnas: accel_x/y/z y opcionalmente gyro_x/y/z
+# --------------------------------------------------
+def process_imu_features(df, fs=100, session_key=None):
+    """
+    Devuelve:
+    - features por ventana (DataFrame)
+    - resumen de carga de la sesión (dict)
+    """
+    features = get_session_features(session_key, df, fs)
+    if features is None or features.empty:
+        return features, None
+    return features, compute_dance_workload(df, fs, session_key=session_key)
+
+
+# --------------------------------------------------
+# Grabaciones OpenSignals / BITalino (.txt o .h5)
+# Se procesan por bloques sin cargar el fichero entero
+# --------------------------------------------------
+def compute_bpm_from_recording(path, channel="ECG", chunk_s=60):
+    """
+    Devuelve un DataFrame con t_start, bpm y hrv por bloque de `chunk_s` segundos.
+    """
+    rec = read_opensignals(path) if isinstance(path, str) else path
+    resolution = rec.resolution(channel)
+    rows = []
+    for t_start, chunk in rec.iter_chunks([channel], chunk_s):
+        ecg = ecg_to_mv(chunk[channel], resolution)
+        bpm, hrv, _ = load_ecg_and_compute_bpm(pd.DataFrame({"ECG": ecg}), fs=rec.fs)
+        rows.append({"t_start": t_start, "bpm": bpm, "hrv": hrv})
+    return pd.DataFrame(rows)
+
+
+def iter_imu_from_recording(path, axes, chunk_s=60):
+    """
+    axes: {"accel_x": "A3", "accel_y": "A4", "accel_z": "A5"} (etiqueta o sensor)
+    Devuelve (t_inicio, DataFrame en m/s²) listo para process_imu / process_imu_features.
+    """
+    rec = read_opensignals(path) if isinstance(path, str) else path
+    for t_start, chunk in rec.iter_chunks(list(axes.values()), chunk_s):
+        yield t_start, pd.DataFrame({
+            col: acc_to_ms2(chunk[name], rec.resolution(name)) for col, name in axes.items()
+        })
+
+
+def process_imu_recording(path, axes, chunk_s=60):
+    """
+    Features IMU de toda la grabación, calculadas bloque a bloque.
+    """
+    rec = read_opensignals(path) if isinstance(path, str) else path
+    parts = []
+    for t_start, df in iter_imu_from_recording(rec, axes, chunk_s):
+        features, _ = process_imu_features(df, fs=rec.fs)
+        if features is not None and not features.empty:
+            features["t_start"] += t_start
+            parts.append(features)
+    return pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+
+# --------------------------------------------------
+# PROTOCOLO BINARIO DE INGESTA
+# Cabecera fija + layout de canales + bloque de muestras
+# little-endian intercaladas (n_samples x n_channels)
+# --------------------------------------------------
+PACKET_MAGIC = b"MDS1"
+PACKET_VERSION = 1
+# magic, versión, dtype, nº canales, reservado, user_id, t0 (epoch s), fs, nº muestras, source
+PACKET_HEADER = struct.Struct("<4sBBBxIddI8s")
+
+CHANNELS = ["bpm", "spo2", "accel_x", "accel_y", "accel_z", "gyro_x", "gyro_y", "gyro_z", "hrv"]
+DTYPES = {0: np.dtype("<f4"), 1: np.dtype("<i2")}
+DTYPE_CODES = {"float32": 0, "int16": 1}
+
+
+def encode_sensor_packet(user_id, source, t0, fs, channels, dtype="float32", scales=None):
+    """
+    channels: {"accel_x": array, ...} todas de la misma longitud
+    dtype: "float32" o "int16" (con `scales` por canal: valor = raw * scale)
+    """
+    names = list(channels)
+    code = DTYPE_CODES[dtype]
+    samples = np.column_stack([np.asarray(channels[k], dtype=float) for k in names])
+
+    header = PACKET_HEADER.pack(
+        PACKET_MAGIC, PACKET_VERSION, code, len(names),
+        int(user_id), float(t0), float(fs), len(samples),
+        source.encode("utf-8")[:8]
+    )
+    layout = bytes(CHANNELS.index(k) for k in names)
+
+    if code == 1:
+        scales = np.asarray(scales if scales is not None else [1.0] * len(names), dtype="<f4")
+        raw = np.round(samples / scales).clip(-32768, 32767).astype("<i2")
+        return header + layout + scales.tobytes() + raw.tobytes()
+
+    return header + layout + samples.astype("<f4").tobytes()
+
+
+def decode_sensor_packet(buf):
+    """
+    Decodifica un paquete sin copiar las muestras (numpy.frombuffer).
+    Devuelve dict con user_id, source, t0, fs, timestamps y channels {nombre: array}.
+    """
+    if len(buf) < PACKET_HEADER.size:
+        raise ValueError("Paquete demasiado corto")
+
+    magic, version, code, n_ch, user_id, t0, fs, n, source = PACKET_HEADER.unpack_from(buf, 0)
+    if magic != PACKET_MAGIC or version != PACKET_VERSION:
+        raise ValueError("Cabecera de paquete no válida")
+    if code not in DTYPES or fs <= 0:
+        raise ValueError("Formato de muestras no soportado")
+
+    offset = PACKET_HEADER.size
+    layout = buf[offset:offset + n_ch]
+    if len(layout) != n_ch or any(c >= len(CHANNELS) for c in layout):
+        raise ValueError("Layout de canales no válido")
+    names = [CHANNELS[c] for c in layout]
+    offset += n_ch
+
+    scales = None
+    if code == 1:
+        scales = np.frombuffer(buf, dtype="<f4", count=n_ch, offset=offset)
+        offset += 4 * n_ch
+
+    dtype = DTYPES[code]
+    if len(buf) - offset != n * n_ch * dtype.itemsize:
+        raise ValueError("Tamaño de bloque de muestras incorrecto")
+
+    samples = np.frombuffer(buf, dtype=dtype, count=n * n_ch, offset=offset).reshape(n, n_ch)
+    channels = {}
+    for i, name in enumerate(names):
+        col = samples[:, i]  # vista
+        channels[name] = col * scales[i] if scales is not None else col
+
+    return {
+        "user_id": user_id,
+        "source": source.rstrip(b"\0").decode("utf-8") or "bin",
+        "t0": t0,
+        "fs": fs,
+        "timestamps": t0 + np.arange(n) / fs,
+        "channels": channels,
+    }
+
+
+# --------------------------------------------------
+# CLIENTE STORE-AND-FORWARD
+# Las muestras se guardan primero en un spool SQLite local
+# y se envían por lotes comprimidos; si cae la Wi-Fi no se pierde nada
+# --------------------------------------------------
+def _batch_confirmed(r):
+    # Solo un 2xx con status ok/duplicate confirma que el lote está guardado
+    if not 200 <= r.status_code < 300:
+        return False
+    try:
+        body = r.json()
+    except ValueError:
+        return False
+    return isinstance(body, dict) and body.get("status") in ("ok", "duplicate")
+
+
+class SensorUploader:
+    """
+    uploader = SensorUploader(); uploader.start(); uploader.enqueue({...})
+
+    - Cada lote tiene un Idempotency-Key fijo: los reintentos no duplican datos
+    - Backoff exponencial con jitter ante errores de red o 5xx
+    - Tras una caída, el spool se vacía a un máximo de `max_batches_per_s`
+    """
+
+    def __init__(self, api_url=API_URL, spool_path="data/spool.db", batch_size=200,
+                 max_batches_per_s=2.0, min_backoff=1.0, max_backoff=60.0, timeout=10):
+        self.api_url = api_url
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.min_interval = 1.0 / max_batches_per_s
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+        os.makedirs(os.path.dirname(spool_path) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id TEXT,
+                payload TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_spool_batch ON spool (batch_id)")
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.spool_path, timeout=30)
+
+    def enqueue(self, sample):
+        sample = dict(sample)
+        sample.setdefault("ts", time.time())
+        conn = self._connect()
+        conn.execute("INSERT INTO spool (payload) VALUES (?)", (json.dumps(sample),))
+        conn.commit()
+        conn.close()
+        self._wake.set()
+
+    def pending(self):
+        conn = self._connect()
+        n = conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        conn.close()
+        return n
+
+    def _next_batch(self):
+        """
+        Reutiliza un lote ya formado y no confirmado (mismo Idempotency-Key)
+        o forma uno nuevo con las muestras más antiguas.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT batch_id FROM spool WHERE batch_id IS NOT NULL ORDER BY seq LIMIT 1"
+        ).fetchone()
+        if row:
+            batch_id = row[0]
+        else:
+            batch_id = uuid.uuid4().hex
+            conn.execute("""
+                UPDATE spool SET batch_id=? WHERE seq IN (
+                    SELECT seq FROM spool WHERE batch_id IS NULL ORDER BY seq LIMIT ?
+                )
+            """, (batch_id, self.batch_size))
+            conn.commit()
+        payloads = [r[0] for r in conn.execute(
+            "SELECT payload FROM spool WHERE batch_id=? ORDER BY seq", (batch_id,)
+        )]
+        conn.close()
+        return batch_id, payloads
+
+    def flush_once(self):
+        """
+        Envía un lote. Devuelve el nº de muestras confirmadas (0 si el spool está vacío).
+        Lanza excepción si el envío falla.
+        """
+        batch_id, payloads = self._next_batch()
+        if not payloads:
+            return 0
+
+        body = gzip.compress(('{"samples": [' + ",".join(payloads) + "]}").encode("utf-8"))
+        r = requests.post(self.api_url, data=body, timeout=self.timeout, headers={
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "Idempotency-Key": batch_id,
+        })
+        if r.status_code == 400:
+            # Lote rechazado por el servidor: reintentar no lo arreglaría
+            print(f"❌ Lote {batch_id} descartado: {r.status_code} {r.text[:200]}")
+        elif not _batch_confirmed(r):
+            # 5xx, 429, 409 (lote aún en curso), proxies, respuestas raras... → reintento
+            raise IOError(f"Servidor respondió {r.status_code}: {r.text[:200]}")
+
+        conn = self._connect()
+        conn.execute("DELETE FROM spool WHERE batch_id=?", (batch_id,))
+        conn.commit()
+        conn.close()
+        return len(payloads)
+
+    def run(self):
+        backoff = self.min_backoff
+        while not self._stop.is_set():
+            try:
+                sent = self.flush_once()
+                backoff = self.min_backoff
+            except Exception as e:
+                wait = random.uniform(0, backoff)
+                print(f"⚠️ Envío fallido ({e}); reintento en {wait:.1f} s")
+                self._stop.wait(wait)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            if sent:
+                # Ritmo limitado mientras se vacía el spool tras una caída
+                self._stop.wait(self.min_interval)
+            else:
+                self._wake.wait(1.0)
+                self._wake.clear()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, daemon=True, name="sensor-uploader")
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
 # --------------------------------------------------
 # SIMULADOR REALISTA
 # --------------------------------------------------
-def simulate_sensor_data():
+def simulate_sensor_data(binary=False):
     # Listar usuarios para elegir
     athletes = get_athletes_by_sport("baile")
     if not athletes:
@@ -107,6 +426,10 @@ def simulate_sensor_data():
 
     user_id = int(input("Introduce el ID del usuario a simular: "))
 
+    if binary:
+        return simulate_sensor_stream(user_id)
+
+    uploader = SensorUploader().start()
     print("Simulación iniciada... presiona CTRL+C para parar")
     t = 0
     while True:
@@ -135,18 +458,50 @@ def simulate_sensor_data():
             "gyro": gyro
         }
 
+        uploader.enqueue(payload)
+        print(f"{time.strftime('%H:%M:%S')} | En cola: {payload} | Pendientes: {uploader.pending()}")
+
+        t += 1
+        time.sleep(2)
+
+
+# --------------------------------------------------
+# SIMULADOR DE ALTA FRECUENCIA (protocolo binario)
+# --------------------------------------------------
+def simulate_sensor_stream(user_id, fs=100, block_s=1.0):
+    """
+    Envía bloques de IMU a `fs` Hz codificados con encode_sensor_packet.
+    """
+    print(f"Stream binario a {fs} Hz iniciado... presiona CTRL+C para parar")
+    n = int(fs * block_s)
+    t0 = time.time()
+    while True:
+        t = t0 + np.arange(n) / fs
+        channels = {
+            "bpm": 70 + 15 * np.sin(t / 10) + np.random.uniform(-5, 5, n),
+            "accel_x": np.random.uniform(-2, 2, n),
+            "accel_y": np.random.uniform(-2, 2, n),
+            "accel_z": 9.81 + 2 * np.sin(2 * np.pi * 2 * t) + np.random.uniform(-1, 1, n),
+            "gyro_x": np.random.uniform(-1, 1, n),
+            "gyro_y": np.random.uniform(-1, 1, n),
+            "gyro_z": np.random.uniform(-1, 1, n),
+        }
+        packet = encode_sensor_packet(user_id, "SimBin", t0, fs, channels)
+
         try:
-            r = requests.post(API_URL, json=payload)
-            print(f"{time.strftime('%H:%M:%S')} | Enviado: {payload} | Estado: {r.status_code}")
+            r = requests.post(API_URL, data=packet,
+                              headers={"Content-Type": "application/octet-stream"})
+            print(f"{time.strftime('%H:%M:%S')} | {n} muestras ({len(packet)} bytes) | Estado: {r.status_code}")
         except Exception as e:
             print("❌ Error enviando datos:", e)
 
-        t += 1
-        time.sleep(2)
+        t0 += block_s
+        time.sleep(max(0.0, t0 - time.time()))
 
 
 # --------------------------------------------------
 # FUNCION PARA EJECUTAR SIMULADOR DESDE TERMINAL
 # --------------------------------------------------
 if __name__ == "__main__":
-    simulate_sensor_data()
+    # python sensors.py --binary  → stream a 100 Hz con el protocolo binario
+    simulate_sensor_data(binary="--binary" in sys.argv)